@@ -0,0 +1,10 @@
+-- auto_explain для статистики выполнения процедур: модуль загружается в
+-- каждом сеансе, а параметры приложение включает само только на время
+-- профилируемого вызова (SET LOCAL). Выполняется при создании БД, а для
+-- существующей БД - вручную от имени суперпользователя:
+--     docker compose exec -T database psql -U postgres < db/auto_explain.sql
+LOAD 'auto_explain';
+ALTER ROLE student SET session_preload_libraries TO 'auto_explain';
+GRANT SET ON PARAMETER auto_explain.log_min_duration, auto_explain.log_analyze,
+    auto_explain.log_buffers, auto_explain.log_timing, auto_explain.log_nested_statements,
+    auto_explain.log_format, auto_explain.log_level TO student;
@@ -1,5 +1,5 @@
 CREATE DATABASE info21_db;
-CREATE USER student WITH ENCRYPTED PASSWORD 'student';
+CREATE USER student WITH ENCRYPTED PASSWORD 'student' CREATEDB;
 ALTER ROLE student SET client_encoding TO 'utf8';
 ALTER ROLE student SET default_transaction_isolation TO 'read committed';
 ALTER ROLE student SET timezone TO 'UTC';
@@ -1,12 +1,53 @@
+-- Материализованные представления для тяжелых отчетов. Обновляются
+-- командой matviews и после импорта данных (REFRESH ... CONCURRENTLY,
+-- для этого у каждого представления есть уникальный индекс)
+DROP MATERIALIZED VIEW IF EXISTS mv_transferred_points;
+CREATE MATERIALIZED VIEW mv_transferred_points AS
+    SELECT "TransferredPoints"."id" AS "Id1", cte_1."id" AS "Id2",
+           "TransferredPoints"."CheckingPeer" AS "Peer1", "TransferredPoints"."CheckedPeer" AS "Peer2",
+           ("TransferredPoints"."PointsAmount" - cte_1."PointsAmount") AS "PointsAmount"
+    FROM "TransferredPoints" JOIN "TransferredPoints" AS cte_1
+    ON "TransferredPoints"."CheckingPeer" = cte_1."CheckedPeer" AND
+       "TransferredPoints"."CheckedPeer" = cte_1."CheckingPeer";
+CREATE UNIQUE INDEX ON mv_transferred_points ("Id1", "Id2");
+
+DROP MATERIALIZED VIEW IF EXISTS mv_xp;
+CREATE MATERIALIZED VIEW mv_xp AS
+    SELECT "XP"."id" AS "XPId", "Nickname" AS "Peer", "Title" AS "Task", "XPAmount" AS "XP"
+    FROM "Peers"
+         INNER JOIN "Checks" ON "Peers"."Nickname" = "Checks"."Peer"
+         INNER JOIN "Tasks" ON "Checks"."Task" = "Tasks"."Title"
+         INNER JOIN "XP" ON "Checks"."id" = "XP"."Check";
+CREATE UNIQUE INDEX ON mv_xp ("XPId");
+
+DROP MATERIALIZED VIEW IF EXISTS mv_peer_xp;
+CREATE MATERIALIZED VIEW mv_peer_xp AS
+    SELECT "Peer", SUM("XPAmount") AS "XP", COUNT("XPAmount") AS "Completed"
+    FROM "XP" JOIN "Checks" ON "XP"."Check" = "Checks"."id"
+        JOIN "Peers" ON "Checks"."Peer" = "Peers"."Nickname"
+    GROUP BY "Peer";
+CREATE UNIQUE INDEX ON mv_peer_xp ("Peer");
+
+DROP MATERIALIZED VIEW IF EXISTS mv_points_change;
+CREATE MATERIALIZED VIEW mv_points_change AS
+    WITH get_points AS (SELECT "CheckingPeer", SUM("PointsAmount") AS total
+                        FROM "TransferredPoints"
+                        GROUP BY "CheckingPeer" ),
+        give_points AS (SELECT "CheckedPeer", SUM("PointsAmount") AS total
+                        FROM "TransferredPoints"
+                        GROUP BY "CheckedPeer" )
+    SELECT "CheckingPeer" AS "Peer",
+       (get_points.total - give_points.total) AS "PointsChange"
+    FROM get_points JOIN give_points
+        ON get_points."CheckingPeer" = give_points."CheckedPeer";
+CREATE UNIQUE INDEX ON mv_points_change ("Peer");
+
 CREATE OR REPLACE FUNCTION fnc_transferredpoints()
     RETURNS TABLE("Peer1" VARCHAR,
     "Peer2" VARCHAR,
     "PointsAmount" BIGINT) AS $$
-    SELECT "TransferredPoints"."CheckingPeer", "TransferredPoints"."CheckedPeer",
-           ("TransferredPoints"."PointsAmount" - cte_1."PointsAmount")
-    FROM "TransferredPoints" JOIN "TransferredPoints" AS cte_1
-    ON "TransferredPoints"."CheckingPeer" = cte_1."CheckedPeer" AND
-       "TransferredPoints"."CheckedPeer" = cte_1."CheckingPeer"
+    SELECT "Peer1", "Peer2", "PointsAmount"
+    FROM mv_transferred_points
     ORDER BY 1, 2;
     $$ LANGUAGE SQL;
 
@@ -14,11 +55,8 @@ CREATE OR REPLACE FUNCTION  fnc_xp()
     RETURNS TABLE("Peer" VARCHAR,
                   "Task" VARCHAR,
                   "XP" BIGINT) AS $$
-    SELECT "Nickname", "Title", "XPAmount"
-    FROM "Peers"
-         INNER JOIN "Checks" ON "Peers"."Nickname" = "Checks"."Peer"
-         INNER JOIN "Tasks" ON "Checks"."Task" = "Tasks"."Title"
-         INNER JOIN "XP" ON "Checks"."id" = "XP"."Check"
+    SELECT "Peer", "Task", "XP"
+    FROM mv_xp
     ORDER BY 1,2;
 $$ LANGUAGE SQL;
 
@@ -46,16 +84,8 @@ CREATE OR REPLACE PROCEDURE pr_points_change_1(IN result REFCURSOR = 'procedure_
 LANGUAGE plpgsql AS $$
     BEGIN
         OPEN result FOR
-        WITH get_points AS (SELECT "CheckingPeer", SUM("PointsAmount") AS total
-                            FROM "TransferredPoints"
-                            GROUP BY "CheckingPeer" ),
-            give_points AS (SELECT "CheckedPeer", SUM("PointsAmount") AS total
-                            FROM "TransferredPoints"
-                            GROUP BY "CheckedPeer" )
-        SELECT "CheckingPeer" AS "Peer",
-           (get_points.total - give_points.total) AS "PointsChange"
-        FROM get_points JOIN give_points
-            ON get_points."CheckingPeer" = give_points."CheckedPeer"
+        SELECT "Peer", "PointsChange"
+        FROM mv_points_change
         ORDER BY 2 DESC ;
     END;
     $$;
@@ -231,13 +261,12 @@ CREATE OR REPLACE PROCEDURE pr_max_xp(IN result REFCURSOR = 'procedure_result')
     LANGUAGE plpgsql AS $$
 BEGIN
     OPEN result FOR
-        SELECT "Nickname" AS "Peer", SUM("XPAmount") AS "XP"
-        FROM (SELECT "Nickname", "Task", "XPAmount",
-            ROW_NUMBER() OVER (PARTITION BY "Task", "Nickname" ORDER BY "Task" DESC ) AS rating
-              FROM "Checks" INNER JOIN "XP" ON "Checks"."id" = "XP"."Check"
-                  INNER JOIN "Peers" ON "Checks"."Peer" = "Peers"."Nickname") query_xp
+        SELECT "Peer", SUM("XP") AS "XP"
+        FROM (SELECT "Peer", "Task", "XP",
+            ROW_NUMBER() OVER (PARTITION BY "Task", "Peer" ORDER BY "Task" DESC ) AS rating
+              FROM mv_xp) query_xp
         WHERE rating = 1
-        GROUP BY "Nickname"
+        GROUP BY "Peer"
         ORDER BY 2;
 END;
 $$;
@@ -330,17 +359,9 @@ CREATE OR REPLACE PROCEDURE pr_peer_max_count_task(IN result REFCURSOR = 'proced
     LANGUAGE plpgsql AS $$
     BEGIN
        OPEN result FOR
-        WITH max_count AS (SELECT COUNT("XPAmount")
-                           FROM "XP" JOIN "Checks" ON "XP"."Check" = "Checks"."id"
-                               JOIN "Peers" ON "Checks"."Peer" = "Peers"."Nickname"
-                           GROUP BY "Peer"
-                           ORDER BY 1 DESC
-                           LIMIT 1)
-        SELECT "Peer", COUNT("XPAmount") AS "Completed"
-        FROM "XP" JOIN "Checks" ON "XP"."Check" = "Checks"."id"
-            JOIN "Peers" ON "Checks"."Peer" = "Peers"."Nickname"
-        GROUP BY "Peer"
-        HAVING COUNT("XPAmount") = (SELECT * FROM max_count);
+        SELECT "Peer", "Completed"
+        FROM mv_peer_xp
+        WHERE "Completed" = (SELECT MAX("Completed") FROM mv_peer_xp);
        END
     $$;
 
@@ -348,17 +369,9 @@ CREATE OR REPLACE PROCEDURE pr_peer_max_xp(IN result REFCURSOR = 'procedure_resu
     LANGUAGE plpgsql AS $$
     BEGIN
        OPEN result FOR
-        WITH max_xp AS (SELECT SUM("XPAmount")
-                        FROM "XP" JOIN "Checks" ON "XP"."Check" = "Checks"."id"
-                            JOIN "Peers" ON "Checks"."Peer" = "Peers"."Nickname"
-                        GROUP BY "Peer"
-                        ORDER BY 1 DESC
-                        LIMIT 1)
-        SELECT "Peer", SUM("XPAmount") AS "XP"
-        FROM "XP" JOIN "Checks" ON "XP"."Check" = "Checks"."id"
-            JOIN "Peers" ON "Checks"."Peer" = "Peers"."Nickname"
-        GROUP BY "Peer"
-        HAVING SUM("XPAmount") = (SELECT * FROM max_xp);
+        SELECT "Peer", "XP"
+        FROM mv_peer_xp
+        WHERE "XP" = (SELECT MAX("XP") FROM mv_peer_xp);
        END
     $$;
 
@@ -0,0 +1,39 @@
+# Настройки gunicorn для запуска приложения в нескольких процессах:
+#     gunicorn -c info21/gunicorn.conf.py
+# Значения по умолчанию можно изменить переменными окружения GUNICORN_*.
+# Плавная перезагрузка кода и рабочих процессов - сигнал HUP главному
+# процессу, например: docker compose kill -s HUP application
+import multiprocessing
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = "info21.wsgi:application"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Запросы в основном ждут ответа БД, поэтому каждый процесс обслуживает
+# несколько запросов потоками (gthread). Соединения keep-alive от nginx
+# ожидают в общем poll и не занимают потоки
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Перезапуск процесса после max_requests запросов ограничивает рост памяти;
+# разброс не дает всем процессам перезапуститься одновременно
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Длинные процедуры выполняются обработчиком задач, но произвольный
+# SQL-запрос и экспорт выполняются в запросе
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+# Больше keepalive_timeout в upstream nginx, чтобы nginx не отправил
+# запрос в соединение, которое gunicorn уже закрывает
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 75))
+
+# Код загружается в каждом процессе: так HUP перезагружает его, а
+# соединения с БД не наследуются от главного процесса
+preload_app = False
+
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
@@ -40,7 +40,7 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "sql.metrics.TimedDjangoTemplates",
         "DIRS": [TEMPLATES_DIR],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -67,6 +67,66 @@ DATABASES = {
     }
 }
 
+# Кэш результатов процедур и функций хранится в файлах, общих для
+# веб-приложения и обработчика фоновых задач
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "procedures": {
+        "BACKEND": "sql.cache.LRUFileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache", "procedures"),
+        "TIMEOUT": 24 * 60 * 60,
+        "OPTIONS": {
+            "MAX_ENTRIES": 1000,
+            "MAX_BYTES": 64 * 1024 * 1024,
+            "BYTES_CHECK_EVERY": 100,
+        },
+    },
+}
+
+# Сколько строк результата произвольного SQL-запроса показывается на
+# странице; полный результат можно скачать в CSV
+SQL_DISPLAY_ROWS = 1000
+# Сколько строк читается из курсора БД за один запрос FETCH
+SQL_FETCH_SIZE = 2000
+
+# История выполнения процедур, функций и SQL-запросов: время, строки и
+# планы. План сохраняется для выполнений дольше SQL_EXPLAIN_MIN_MS, мс;
+# auto_explain используется, если он разрешен роли в БД
+SQL_STATS = True
+SQL_EXPLAIN_MIN_MS = 1000
+SQL_AUTO_EXPLAIN = True
+SQL_STATS_DAYS = 30
+# Журнал медленных запросов к БД: запросы дольше SQL_SLOW_QUERY_MS, мс,
+# группируются по нормализованному тексту вместе с местом вызова из
+# SQL_SLOW_STACK кадров стека; хранятся SQL_STATS_DAYS дней
+SQL_SLOW_QUERIES = True
+SQL_SLOW_QUERY_MS = 200
+SQL_SLOW_STACK = 8
+
+# Хранилище результатов фоновых задач: сжатые файлы, общие для
+# веб-приложения и обработчика задач, который удаляет устаревшие
+RESULT_STORE = {
+    "LOCATION": os.path.join(BASE_DIR, "cache", "results"),
+    "TIMEOUT": 24 * 60 * 60,
+    "MAX_RESULT_BYTES": 32 * 1024 * 1024,
+    "MAX_BYTES": 512 * 1024 * 1024,
+    "BLOCK_ROWS": 1000,
+}
+
+# Журнал запросов в формате JSON Lines, общий для всех процессов
+LOG_FILE = os.path.join(BASE_DIR, "logs", "info21.log")
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Метрики для /metrics: каждый процесс сохраняет свои значения в общий
+# каталог не чаще раза в METRICS_FLUSH_INTERVAL, с. Из них же берутся
+# счетчики кэша результатов на странице операций
+METRICS_ENABLED = True
+METRICS_DIR = os.path.join(BASE_DIR, "cache", "metrics")
+METRICS_FLUSH_INTERVAL = 5
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -97,5 +157,7 @@ USE_L10N = True
 USE_TZ = True
 
 STATIC_URL = "/static/"
+# Каталог для collectstatic, из которого статические файлы отдает nginx
+STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -2,8 +2,9 @@ from django.contrib import admin
 from django.contrib.auth.models import Group
 from rest_framework.authtoken.models import TokenProxy
 
-from .models import (P2P, XP, Checks, Friends, Peers, Recommendations, Tasks,
-                     TimeTracking, TransferredPoints, Verter)
+from .models import (P2P, XP, Checks, Execution, Friends, ImportFingerprint,
+                     Job, Peers, Recommendations, SlowQuery, TableVersion,
+                     Tasks, TimeTracking, TransferredPoints, Verter)
 
 admin.site.register(Peers)
 admin.site.register(Tasks)
@@ -15,6 +16,11 @@ admin.site.register(Friends)
 admin.site.register(Recommendations)
 admin.site.register(XP)
 admin.site.register(TimeTracking)
+admin.site.register(ImportFingerprint)
+admin.site.register(Job)
+admin.site.register(TableVersion)
+admin.site.register(Execution)
+admin.site.register(SlowQuery)
 
 admin.site.unregister(Group)
 admin.site.unregister(TokenProxy)
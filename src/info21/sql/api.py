@@ -0,0 +1,116 @@
+import re
+
+from django.core.exceptions import ValidationError
+from rest_framework import viewsets
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .registry import DATA_TABLES, get_table
+from .serializers import model_serializer
+from .utils import get_page, parse_filters, parse_sort
+
+# Количество строк на странице API по умолчанию и максимальное
+API_PAGE_SIZE = 1000
+API_MAX_PAGE_SIZE = 10000
+# Параметры запроса API, не являющиеся фильтрами
+API_PARAMS = ("fields", "compact", "format")
+
+
+# Поля из параметра ?fields=; первичный ключ нужен для курсора и
+# возвращается всегда. Неизвестное поле - ответ 400 и для списка, и для
+# одной строки
+def parse_fields(table, value):
+    fields = {field.name: field for field in table.model._meta.fields}
+    if not value:
+        return list(fields.values())
+    names = [name for name in value.split(",") if name]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise ParseError(f"Недопустимые поля: {', '.join(unknown)}")
+    return [table.pk] + [fields[name] for name in names if fields[name] != table.pk]
+
+
+class TableViewSet(viewsets.ReadOnlyModelViewSet):
+    """Чтение таблицы через API.
+
+    Список читается страницами по первичному ключу (keyset): ссылка next
+    содержит ?after=<pk> последней строки. Для таблиц с id новые строки
+    можно забирать, повторяя запрос с after последнего полученного id.
+    Поддерживаются фильтры и сортировка страницы таблицы, ?fields= для
+    выбора столбцов и ?compact=1 для ответа в виде массивов строк.
+    """
+
+    table_name = None
+
+    def get_queryset(self):
+        table = get_table(self.table_name)
+        fields = parse_fields(table, self.request.query_params.get("fields"))
+        return table.model.objects.only(*[field.name for field in fields])
+
+    def list(self, request, *args, **kwargs):
+        table = get_table(self.table_name)
+        params = request.query_params
+        fields = parse_fields(table, params.get("fields"))
+        try:
+            size = min(max(int(params.get("size", API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+            after, before = (
+                table.pk.to_python(params[key]) if params.get(key) else None
+                for key in ("after", "before")
+            )
+            filters = parse_filters(
+                table, {key: value for key, value in params.items() if key not in API_PARAMS}
+            )
+            sort = parse_sort(table, params["sort"]) if params.get("sort") else None
+            page = get_page(
+                table.model,
+                after,
+                before,
+                size,
+                filters,
+                sort,
+                columns=[field.attname for field in fields],
+            )
+        except (ValueError, ValidationError) as err:
+            raise ParseError(str(err))
+        names = [field.name for field in fields]
+        rows = [[row[field.attname] for field in fields] for row in page["rows"]]
+        data = {
+            "next": self.page_link("after", page["next"]),
+            "previous": self.page_link("before", page["prev"]),
+        }
+        if params.get("compact") == "1":
+            data.update(columns=names, rows=rows)
+        else:
+            data["results"] = [dict(zip(names, row)) for row in rows]
+        return Response(data)
+
+    def page_link(self, key: str, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, "after" if key == "before" else "before")
+        return replace_query_param(url, key, cursor)
+
+
+# Набор представлений API для каждой таблицы из registry.DATA_TABLES, по
+# аналогии с build_registry. Вызывается при загрузке URL, когда реестр уже
+# построен
+def build_viewsets():
+    return {
+        table_name: type(
+            f"{table_name}ViewSet",
+            (TableViewSet,),
+            {
+                "table_name": table_name,
+                "serializer_class": model_serializer(get_table(table_name).model),
+                "__module__": __name__,
+            },
+        )
+        for table_name in DATA_TABLES
+    }
+
+
+# Имя маршрута API: TransferredPoints -> api_transferred_points
+def api_basename(table_name: str):
+    return "api_" + re.sub(r"(?<=[a-z])(?=[A-Z])", "_", table_name).lower()
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class SqlConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "sql"
+
+    def ready(self):
+        from django.core.checks import Tags, register
+        from django.db.backends.signals import connection_created
+
+        from .registry import build_registry
+        from .slowlog import install_recorder
+        from .stats import check_auto_explain, setup_auto_explain
+
+        build_registry()
+        connection_created.connect(setup_auto_explain)
+        connection_created.connect(install_recorder)
+        register(check_auto_explain, Tags.database)
@@ -0,0 +1,70 @@
+import os
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+_missing = object()
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """Файловый кэш с ограничением суммарного размера.
+
+    Время изменения файла обновляется при каждом чтении, и при превышении
+    OPTIONS["MAX_BYTES"] удаляются давно не читавшиеся записи. Каталог кэша
+    общий для всех процессов, которые его используют.
+
+    Размер кэша процесс считает сам, прибавляя размеры своих записей, и
+    обходит каталог только при превышении лимита и раз в
+    OPTIONS["BYTES_CHECK_EVERY"] записей, чтобы учесть записи других
+    процессов.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        options = params.get("OPTIONS", {})
+        self._max_bytes = int(options.get("MAX_BYTES", 64 << 20))
+        self._check_every = int(options.get("BYTES_CHECK_EVERY", 100))
+        self._bytes = None
+        self._sets = 0
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            return default
+        try:
+            os.utime(self._key_to_file(key, version))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        self._sets += 1
+        if self._bytes is not None and self._sets % self._check_every:
+            try:
+                self._bytes += os.path.getsize(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+            if self._bytes <= self._max_bytes:
+                return
+        self._bytes = self._cull_bytes()
+
+    # Удаление самых старых записей, пока кэш не уменьшится до 90% лимита.
+    # Возвращает размер кэша после удаления
+    def _cull_bytes(self):
+        files = []
+        for fname in self._list_cache_files():
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, fname))
+        total = sum(size for _, size, _ in files)
+        if total <= self._max_bytes:
+            return total
+        for _, size, fname in sorted(files):
+            if total <= self._max_bytes * 0.9:
+                break
+            if self._delete(fname):
+                total -= size
+        return total
@@ -0,0 +1,173 @@
+import csv
+import io
+import queue
+import threading
+import zipfile
+import zlib
+
+from django.db import connection, transaction
+
+# Количество строк, читаемых из БД и отправляемых клиенту за один раз
+EXPORT_CHUNK_SIZE = 2000
+# Максимальное число кусков, ожидающих отправки клиенту
+STREAM_QUEUE_SIZE = 16
+# Размер куска, которым данные COPY передаются клиенту
+WRITE_BUFFER = 1 << 16
+
+
+# Заголовок CSV: db_column полей, для таблиц с id первым столбцом идет "ID"
+def export_header(model):
+    if model.__name__ in ["Peers", "Tasks"]:
+        return [field.db_column for field in model._meta.fields]
+    return ["ID"] + [field.db_column for field in model._meta.fields if field.db_column]
+
+
+# Построчная выгрузка таблицы в CSV через серверный курсор: в памяти
+# находится не больше EXPORT_CHUNK_SIZE строк
+def iter_csv(model, chunk_size: int = EXPORT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_header(model))
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    rows = model.objects.values_list(
+        *[field.attname for field in model._meta.fields]
+    ).iterator(chunk_size=chunk_size)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Пустые строки выгружаются без кавычек, как и при записи через csv.writer
+def copy_sql(model):
+    qn = connection.ops.quote_name
+    columns = ", ".join(
+        (
+            f"NULLIF({qn(field.column)}, '') AS {qn(name)}"
+            if field.get_internal_type() in ("CharField", "TextField")
+            else f"{qn(field.column)} AS {qn(name)}"
+        )
+        for field, name in zip(model._meta.fields, export_header(model))
+    )
+    return (
+        f"COPY (SELECT {columns} FROM {qn(model._meta.db_table)}) "
+        "TO STDOUT WITH (FORMAT csv, HEADER)"
+    )
+
+
+# Выгрузка таблицы в CSV средствами PostgreSQL
+def iter_copy(model):
+    def produce(write):
+        writer = QueueWriter(write)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(copy_sql(model), writer)
+        writer.flush()
+
+    return stream_from_thread(produce)
+
+
+# Выгрузка всех таблиц в один ZIP-архив из одного снимка данных: все COPY
+# выполняются в одной транзакции REPEATABLE READ, поэтому файлы архива
+# согласованы между собой даже при параллельной записи в таблицы
+def write_snapshot(file, models):
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for model in models:
+                with archive.open(f"{model.__name__}.csv", "w", force_zip64=True) as member:
+                    cursor.copy_expert(copy_sql(model), member)
+
+
+def iter_snapshot(models):
+    def produce(write):
+        writer = QueueWriter(write)
+        write_snapshot(writer, models)
+        writer.flush()
+
+    return stream_from_thread(produce)
+
+
+class StreamClosed(Exception):
+    """Клиент перестал читать поток."""
+
+
+class QueueWriter:
+    """Файловый объект, собирающий записанные данные в куски по WRITE_BUFFER байт."""
+
+    def __init__(self, write):
+        self.send = write
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= WRITE_BUFFER:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.send(b"".join(self.buffer))
+            self.buffer, self.size = [], 0
+
+
+# Запуск produce(write) в отдельном потоке со своим соединением с БД.
+# Записанные куски отдаются по мере готовности; очередь ограничена, поэтому
+# поток ждет, пока клиент не прочитает данные.
+def stream_from_thread(produce):
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    closed = threading.Event()
+    done = object()
+
+    def write(data):
+        while not closed.is_set():
+            try:
+                chunks.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise StreamClosed()
+
+    def run():
+        end = done
+        try:
+            produce(write)
+        except StreamClosed:
+            return
+        except Exception as err:
+            end = err
+        finally:
+            connection.close()
+        try:
+            write(end)
+        except StreamClosed:
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        closed.set()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
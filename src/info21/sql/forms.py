@@ -1,16 +1,19 @@
+import re
+
 from django import forms
 
+# Простое значение по умолчанию аргумента, например '10'::integer или 5
+DEFAULT_LITERAL = re.compile(r"^'?([^']*)'?(::[\w ]+)?$")
+
 
 class DynamicForm(forms.Form):
     """Класс для создания динамических форм."""
 
-    def __init__(self, param_string, *args, **kwargs):
+    def __init__(self, procedure, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        params = [p.strip().split(" ") for p in param_string.split(",")]
-        for param in params:
-            name, data_type = param[0], param[1]
-            if param[0] == "IN" or param[0] == "OUT":
-                name, data_type = param[1], param[2]
+        self.procedure = procedure
+        for arg in procedure.input_args:
+            name, data_type = arg.name, arg.type.split(" ")[0]
             if data_type == "character" and "date" not in name:
                 self.fields[name] = forms.CharField(
                     widget=forms.TextInput(
@@ -51,9 +54,16 @@ class DynamicForm(forms.Form):
                         }
                     )
                 )
-            elif "refcursor" not in data_type:
+            else:
                 self.fields[name] = forms.CharField(
                     widget=forms.TextInput(
                         attrs={"class": "form-control", "placeholder": data_type}
                     )
                 )
+            match = DEFAULT_LITERAL.match(arg.default or "")
+            if arg.default and match:
+                self.fields[name].initial = match.group(1)
+
+    # Значения аргументов в порядке их объявления в процедуре
+    def params(self):
+        return [self.cleaned_data[arg.name] for arg in self.procedure.input_args]
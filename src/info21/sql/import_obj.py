@@ -1,166 +1,580 @@
+import codecs
+import hashlib
+import io
 import os
+import time
+import zipfile
+import zlib
 from csv import reader
-from datetime import datetime
+from typing import NamedTuple
 
-from django.db import connection
+from django.apps import apps
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             StopFutureHandlers)
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
-from .models import (P2P, XP, Checks, Friends, Peers, Recommendations, Tasks,
-                     TimeTracking, TransferredPoints, Verter)
+from .models import (P2P, XP, Checks, Friends, ImportFingerprint, Peers,
+                     Recommendations, Tasks, TimeTracking, TransferredPoints,
+                     Verter)
+from .matviews import mark_refreshed, matview_status
+from .procedures import CATALOG
+from .versions import bump_version
 
+# Количество строк CSV, загружаемых в БД за одну транзакцию
+BATCH_SIZE = 50000
+# Размер куска, которым читается исходный файл
+CHUNK_SIZE = 1 << 20
 
-def import_peers():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/Peers.csv"
-    )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            Peers.objects.get_or_create(
-                nickname=row[0], birthday=datetime.strptime(row[1], "%Y-%m-%d").date()
-            )
+GZIP_MAGIC = b"\x1f\x8b"
 
 
-def import_tasks():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/Tasks.csv"
-    )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            Tasks.objects.get_or_create(
-                title=row[0], parent_task=row[1], max_xp=int(row[2])
-            )
+class ImportStats(NamedTuple):
+    """Итоги загрузки одной таблицы."""
+
+    table: str
+    rows: int
+    inserted: int
+    seconds: float
+    updated: int = 0
+    deleted: int = 0
+    unchanged: bool = False
+    # Строки, которых нет в файле, но на которые ссылаются другие таблицы
+    kept: int = 0
 
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
 
-def import_checks():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/Checks.csv"
+    def __str__(self):
+        if self.unchanged:
+            return f"{self.table}: файл не изменился"
+        changes = f"добавлено {self.inserted}"
+        if self.updated or self.deleted:
+            changes += f", изменено {self.updated}, удалено {self.deleted}"
+        if self.kept:
+            changes += f", оставлено со ссылками {self.kept}"
+        return (
+            f"{self.table}: {self.rows} строк ({changes}) "
+            f"за {self.seconds:.2f} с, {self.rows_per_sec:.0f} строк/с"
+        )
+
+
+def data_path(file_name: str):
+    return os.path.abspath(__file__).replace(
+        os.path.basename(__file__), "../data/" + file_name
     )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            Checks.objects.get_or_create(
-                id=int(row[0]),
-                peer=Peers.objects.get(nickname=row[1]),
-                task=Tasks.objects.get(title=row[2]),
-                date=datetime.strptime(row[3], "%Y-%m-%d").date(),
+
+
+# Заголовок столбца в CSV совпадает с db_column поля, для id - "ID"
+def csv_columns(model):
+    return {
+        ("ID" if field.primary_key and not field.db_column else field.db_column): field
+        for field in model._meta.concrete_fields
+    }
+
+
+class BulkLoader:
+    """Загрузка CSV-текста в таблицу пачками через COPY во временную таблицу.
+
+    Текст подается кусками произвольной длины через feed(): строки копируются
+    во временную таблицу, откуда одним INSERT ... SELECT переносятся в целевую.
+    Строки со ссылками на отсутствующие записи прерывают загрузку с
+    ValueError, уже существующие строки пропускаются.
+    """
+
+    def __init__(self, model, batch_size: int = BATCH_SIZE, on_progress=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.staging = connection.ops.quote_name(f"_stage_{model._meta.db_table}")
+        self.header = None
+        self.tail = ""
+        self.buffer = []
+        self.buffered = 0
+        self.rows = 0
+        self.inserted = 0
+        self.started = time.monotonic()
+
+    def feed(self, text: str):
+        text = self.tail + text
+        if self.header is None:
+            end = text.find("\n")
+            if end == -1:
+                self.tail = text
+                return
+            self._start(text[:end])
+            text = text[end + 1:]
+        # Хвост без перевода строки дожидается следующего куска
+        end = text.rfind("\n") + 1
+        self.tail = text[end:]
+        if end:
+            self.buffer.append(text[:end])
+            self.buffered += text.count("\n", 0, end)
+            if self.buffered >= self.batch_size:
+                self.flush()
+
+    def finish(self):
+        self.end_input()
+        self.close()
+        return self.stats()
+
+    def end_input(self):
+        if self.tail.strip():
+            self.buffer.append(self.tail + "\n")
+            self.tail = ""
+        self.flush()
+
+    def close(self):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [self.model]):
+                cursor.execute(sql)
+            if self.header is not None:
+                cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{self.staging}")
+
+    def stats(self):
+        return ImportStats(
+            self.model.__name__,
+            self.rows,
+            self.inserted,
+            time.monotonic() - self.started,
+        )
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data, self.buffer, self.buffered = "".join(self.buffer), [], 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.copy_expert(self.copy_sql, io.StringIO(data))
+            self.rows += cursor.rowcount
+            self.merge(cursor)
+        if self.on_progress:
+            self.on_progress(self.rows)
+
+    def merge(self, cursor):
+        check_references(self.model, self.staging, "s", cursor)
+        cursor.execute(self.insert_sql)
+        self.inserted += cursor.rowcount
+        cursor.execute(f"TRUNCATE {self.staging}")
+
+    def _start(self, header_line: str):
+        qn = connection.ops.quote_name
+        columns = csv_columns(self.model)
+        header = next(reader([header_line.strip("\r\ufeff")]))
+        if sorted(header) != sorted(columns):
+            raise ValueError(
+                f"Неверный заголовок CSV для {self.model.__name__}: "
+                f"ожидались столбцы {', '.join(columns)}"
             )
+        self.header = header
+        staging_columns = ", ".join(f"{qn(name)} text" for name in header)
+        quoted = ", ".join(qn(name) for name in header)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{self.staging}")
+            cursor.execute(f"CREATE TEMP TABLE {self.staging} ({staging_columns})")
+        self.copy_sql = (
+            f"COPY {self.staging} ({quoted}) FROM STDIN "
+            f"WITH (FORMAT csv, FORCE_NOT_NULL ({quoted}))"
+        )
+        self.insert_sql = build_insert_sql(self.model, self.staging, "s")
 
 
-def import_p2p():
-    f = os.path.abspath(__file__).replace(os.path.basename(__file__), "../data/P2P.csv")
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            P2P.objects.get_or_create(
-                id=int(row[0]),
-                check_2p2=Checks.objects.get(id=row[1]),
-                checking_peer=Peers.objects.get(nickname=row[2]),
-                state=row[3],
-                time=datetime.strptime(row[4], "%H:%M:%S").time(),
+class DeltaLoader(BulkLoader):
+    """Синхронизация таблицы с CSV-файлом по первичному ключу.
+
+    Файл целиком копируется во временную таблицу, после чего добавляются
+    новые строки, обновляются строки с отличающимися значениями и удаляются
+    строки, которых нет в файле. Неизменные строки не перезаписываются.
+    """
+
+    updated = deleted = kept = 0
+
+    def merge(self, cursor):
+        # Строки накапливаются во временной таблице до конца файла
+        pass
+
+    def upsert(self):
+        if self.header is None:
+            raise ValueError(f"Файл для {self.model.__name__} пуст")
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {self.staging}")
+            check_references(self.model, self.staging, "s", cursor)
+            cursor.execute(build_update_sql(self.model, self.staging, "s"))
+            self.updated = cursor.rowcount
+            cursor.execute(self.insert_sql)
+            self.inserted = cursor.rowcount
+
+    # Удаление строк, которых нет в файле. Строки, на которые ссылаются
+    # другие таблицы, не удаляются и учитываются в kept: иначе внешний ключ
+    # прервал бы весь импорт
+    def delete_missing(self):
+        with connection.cursor() as cursor:
+            cursor.execute(build_delete_sql(self.model, self.staging, "s", count=True))
+            missing = cursor.fetchone()[0]
+            cursor.execute(build_delete_sql(self.model, self.staging, "s"))
+            self.deleted = cursor.rowcount
+        self.kept = missing - self.deleted
+
+    def stats(self):
+        return super().stats()._replace(
+            updated=self.updated, deleted=self.deleted, kept=self.kept
+        )
+
+
+# Преобразование текстового столбца временной таблицы к типу поля модели
+def cast_column(field, alias: str, name: str):
+    qn = connection.ops.quote_name
+    db_type = field.db_type(connection)
+    if db_type.startswith("varchar") or db_type == "text":
+        return f"{alias}.{qn(name)}"
+    return f"NULLIF({alias}.{qn(name)}, '')::{db_type}"
+
+
+# Выборка строк временной таблицы, приведенных к типам модели
+def build_select_sql(model, staging: str, alias: str):
+    qn = connection.ops.quote_name
+    values = [
+        f"{cast_column(field, alias, name)} AS {qn(field.column)}"
+        for name, field in csv_columns(model).items()
+    ]
+    return f"SELECT {', '.join(values)} FROM {staging} {alias}"
+
+
+# Для каждого внешнего ключа - запрос числа строк временной таблицы, которые
+# ссылаются на отсутствующие записи, и пример такого значения
+def build_orphans_sql(model, staging: str, alias: str):
+    qn = connection.ops.quote_name
+    queries = []
+    for name, field in csv_columns(model).items():
+        if not field.is_relation:
+            continue
+        value = cast_column(field, alias, name)
+        related = field.related_model._meta
+        queries.append(
+            (
+                name,
+                related.object_name,
+                f"SELECT count(*), min({alias}.{qn(name)}) FROM {staging} {alias} "
+                f"WHERE {value} IS NOT NULL AND NOT EXISTS "
+                f"(SELECT 1 FROM {qn(related.db_table)} r "
+                f"WHERE r.{qn(field.target_field.column)} = {value})",
             )
+        )
+    return queries
 
 
-def import_verter():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/Verter.csv"
-    )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            Verter.objects.get_or_create(
-                id=int(row[0]),
-                check_verter=Checks.objects.get(id=row[1]),
-                state=row[2],
-                time=datetime.strptime(row[3], "%H:%M:%S").time(),
+# Строки со ссылками на отсутствующие записи не пропускаются молча, а
+# прерывают загрузку, как и ограничение внешнего ключа
+def check_references(model, staging: str, alias: str, cursor):
+    for name, related, sql in build_orphans_sql(model, staging, alias):
+        cursor.execute(sql)
+        orphans, example = cursor.fetchone()
+        if orphans:
+            raise ValueError(
+                f"{model.__name__}: {orphans} строк ссылаются на отсутствующие "
+                f"записи {related} в столбце {name}, например {example}"
             )
 
 
-def import_transferred_points():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/TransferredPoints.csv"
+def build_insert_sql(model, staging: str, alias: str):
+    qn = connection.ops.quote_name
+    targets = ", ".join(qn(field.column) for field in csv_columns(model).values())
+    return (
+        f"INSERT INTO {qn(model._meta.db_table)} ({targets}) "
+        f"{build_select_sql(model, staging, alias)} ON CONFLICT DO NOTHING"
     )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            TransferredPoints.objects.get_or_create(
-                id=int(row[0]),
-                checking_peer=Peers.objects.get(nickname=row[1]),
-                checked_peer=Peers.objects.get(nickname=row[2]),
-                points_amount=int(row[3]),
-            )
 
 
-def import_friends():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/Friends.csv"
+def build_update_sql(model, staging: str, alias: str):
+    qn = connection.ops.quote_name
+    pk = qn(model._meta.pk.column)
+    columns = [
+        qn(field.column) for field in csv_columns(model).values() if not field.primary_key
+    ]
+    changed = ", ".join(f"t.{column}" for column in columns)
+    staged = ", ".join(f"v.{column}" for column in columns)
+    return (
+        f"UPDATE {qn(model._meta.db_table)} t "
+        f"SET {', '.join(f'{column} = v.{column}' for column in columns)} "
+        f"FROM ({build_select_sql(model, staging, alias)}) v "
+        f"WHERE t.{pk} = v.{pk} AND ({changed}) IS DISTINCT FROM ({staged})"
     )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            Friends.objects.get_or_create(
-                id=int(row[0]),
-                peer1=Peers.objects.get(nickname=row[1]),
-                peer2=Peers.objects.get(nickname=row[2]),
-            )
 
 
-def import_recommendations():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/Recommendations.csv"
+# Удаление строк, которых нет во временной таблице и на которые не ссылаются
+# другие таблицы; с count=True - подсчет всех строк, которых нет в файле
+def build_delete_sql(model, staging: str, alias: str, count: bool = False):
+    qn = connection.ops.quote_name
+    pk_field = model._meta.pk
+    name = next(name for name, field in csv_columns(model).items() if field is pk_field)
+    missing = (
+        f"NOT EXISTS (SELECT 1 FROM {staging} {alias} "
+        f"WHERE {cast_column(pk_field, alias, name)} = t.{qn(pk_field.column)})"
+    )
+    if count:
+        return f"SELECT count(*) FROM {qn(model._meta.db_table)} t WHERE {missing}"
+    unreferenced = [
+        f"NOT EXISTS (SELECT 1 FROM {qn(rel.related_model._meta.db_table)} r "
+        f"WHERE r.{qn(rel.field.column)} = t.{qn(rel.field.target_field.column)})"
+        for rel in model._meta.related_objects
+    ]
+    return (
+        f"DELETE FROM {qn(model._meta.db_table)} t "
+        f"WHERE {' AND '.join([missing, *unreferenced])}"
     )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            Recommendations.objects.get_or_create(
-                id=int(row[0]),
-                peer=Peers.objects.get(nickname=row[1]),
-                recommended_peer=Peers.objects.get(nickname=row[2]),
-            )
 
 
-def import_xp():
-    f = os.path.abspath(__file__).replace(os.path.basename(__file__), "../data/XP.csv")
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            XP.objects.get_or_create(
-                id=int(row[0]),
-                check_xp=Checks.objects.get(id=row[1]),
-                xp_amount=int(row[2]),
-            )
+class ChunkDecoder:
+    """Инкрементальное декодирование байтов в текст с распаковкой gzip."""
 
+    def __init__(self):
+        self.started = False
+        self.decompressor = None
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
 
-def import_time_tracking():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/TimeTracking.csv"
-    )
-    with open(f, "r", encoding="utf8") as file:
-        file_reader = reader(file)
-        _ = next(file_reader)
-        for row in file_reader:
-            TimeTracking.objects.get_or_create(
-                id=int(row[0]),
-                peer=Peers.objects.get(nickname=row[1]),
-                date=datetime.strptime(row[2], "%Y-%m-%d").date(),
-                time=datetime.strptime(row[3], "%H:%M:%S").time(),
-                state=int(row[4]),
+    def decode(self, data: bytes, final: bool = False):
+        if not self.started and data:
+            self.started = True
+            if data[:2] == GZIP_MAGIC:
+                self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        if self.decompressor:
+            data = self._gunzip(data)
+        return self.decoder.decode(data, final)
+
+    def _gunzip(self, data: bytes):
+        result = []
+        while data:
+            result.append(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data if self.decompressor.eof else b""
+            if data:
+                # Следующий член многосоставного gzip-архива
+                self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        return b"".join(result)
+
+
+# Чтение источника кусками текста: путь к файлу или файловый объект, в т.ч. gzip
+def read_chunks(source, chunk_size: int = CHUNK_SIZE):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            yield from read_chunks(file, chunk_size)
+        return
+    decoder = ChunkDecoder()
+    while True:
+        data = source.read(chunk_size)
+        if not data:
+            break
+        yield data if isinstance(data, str) else decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+
+def load_csv(model, source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    if source is None:
+        source = data_path(f"{model._meta.db_table}.csv")
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            return load_csv(model, file, batch_size, on_progress)
+    report = None
+    if on_progress:
+        # Доля обработанного файла оценивается по прочитанным байтам источника
+        try:
+            size = os.fstat(source.fileno()).st_size
+        except (AttributeError, OSError):
+            size = 0
+
+        def report(rows: int):
+            on_progress(rows, source.tell() / size if size else None)
+
+    loader = BulkLoader(model, batch_size, report)
+    for chunk in read_chunks(source):
+        loader.feed(chunk)
+    return loader.finish()
+
+
+def import_peers(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(Peers, source, batch_size, on_progress)
+
+
+def import_tasks(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(Tasks, source, batch_size, on_progress)
+
+
+def import_checks(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(Checks, source, batch_size, on_progress)
+
+
+def import_p2p(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(P2P, source, batch_size, on_progress)
+
+
+def import_verter(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(Verter, source, batch_size, on_progress)
+
+
+def import_transferred_points(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(TransferredPoints, source, batch_size, on_progress)
+
+
+def import_friends(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(Friends, source, batch_size, on_progress)
+
+
+def import_recommendations(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(Recommendations, source, batch_size, on_progress)
+
+
+def import_xp(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(XP, source, batch_size, on_progress)
+
+
+def import_time_tracking(source=None, batch_size: int = BATCH_SIZE, on_progress=None):
+    return load_csv(TimeTracking, source, batch_size, on_progress)
+
+
+class ImportUploadHandler(FileUploadHandler):
+    """Загрузка CSV-файла из multipart-запроса напрямую в таблицу.
+
+    Куски файла декодируются и передаются в BulkLoader по мере чтения тела
+    запроса, поэтому файл не сохраняется ни в памяти, ни на диске.
+    before_file вызывается перед каждым файлом и может прервать загрузку
+    исключением StopUpload.
+    """
+
+    def __init__(self, model, request=None, batch_size: int = BATCH_SIZE, before_file=None):
+        super().__init__(request)
+        self.model = model
+        self.batch_size = batch_size
+        self.before_file = before_file
+        self.stats = []
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.before_file is not None:
+            self.before_file()
+        self.loader = BulkLoader(self.model, self.batch_size)
+        self.decoder = ChunkDecoder()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.loader.feed(self.decoder.decode(raw_data))
+
+    def file_complete(self, file_size):
+        self.loader.feed(self.decoder.decode(b"", final=True))
+        self.stats.append(self.loader.finish())
+
+
+IMPORT_FUNCS = {
+    "Peers": import_peers,
+    "Tasks": import_tasks,
+    "Checks": import_checks,
+    "P2P": import_p2p,
+    "Verter": import_verter,
+    "TransferredPoints": import_transferred_points,
+    "Friends": import_friends,
+    "Recommendations": import_recommendations,
+    "XP": import_xp,
+    "TimeTracking": import_time_tracking,
+}
+
+
+# Граф зависимостей таблиц по внешним ключам: таблица -> таблицы, на которые она ссылается
+def import_dependencies():
+    graph = {}
+    for table_name in IMPORT_FUNCS:
+        model = apps.get_model(app_label="sql", model_name=table_name)
+        graph[table_name] = {
+            field.related_model.__name__
+            for field in model._meta.concrete_fields
+            if field.is_relation and field.related_model is not model
+        }
+    return graph
+
+
+# Таблицы в порядке загрузки: каждая после всех, на которые она ссылается
+def import_order():
+    graph = import_dependencies()
+    order = []
+    while graph:
+        ready = [table for table, deps in graph.items() if deps <= set(order)]
+        if not ready:
+            raise ValueError(f"Циклическая зависимость таблиц: {', '.join(graph)}")
+        for table in ready:
+            order.append(table)
+            del graph[table]
+    return order
+
+
+# Импорт таблицы из data/ или из одноименного CSV-файла ZIP-архива
+def run_import(table_name: str, batch_size: int = BATCH_SIZE, archive=None):
+    if archive is None:
+        return IMPORT_FUNCS[table_name](batch_size=batch_size)
+    with zipfile.ZipFile(archive) as zip_file, zip_file.open(f"{table_name}.csv") as source:
+        return IMPORT_FUNCS[table_name](source, batch_size=batch_size)
+
+
+def file_fingerprint(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Инкрементальный импорт: загружаются только изменившиеся файлы data/, а в них
+# только отличающиеся строки. Добавление и обновление идут от родительских
+# таблиц к дочерним, удаление - в обратном порядке. Строки, которых нет в
+# файлах, удаляются только с delete_missing: при первом запуске отпечатков
+# нет, и без этого флага строки, добавленные через приложение, сохраняются
+def import_delta(batch_size: int = BATCH_SIZE, delete_missing: bool = False):
+    results, changed = {}, []
+    with transaction.atomic():
+        for table_name in import_order():
+            model = apps.get_model(app_label="sql", model_name=table_name)
+            path = data_path(f"{table_name}.csv")
+            stat = os.stat(path)
+            fingerprint = ImportFingerprint.objects.filter(table=table_name).first()
+            unchanged = ImportStats(table_name, 0, 0, 0.0, unchanged=True)
+            if fingerprint and fingerprint.size == stat.st_size:
+                if fingerprint.mtime == stat.st_mtime:
+                    results[table_name] = unchanged
+                    continue
+            sha256 = file_fingerprint(path)
+            if fingerprint and fingerprint.sha256 == sha256:
+                fingerprint.mtime = stat.st_mtime
+                fingerprint.save(update_fields=["mtime"])
+                results[table_name] = unchanged
+                continue
+            loader = DeltaLoader(model, batch_size)
+            for chunk in read_chunks(path):
+                loader.feed(chunk)
+            loader.end_input()
+            loader.upsert()
+            changed.append(loader)
+            results[table_name] = loader
+            ImportFingerprint.objects.update_or_create(
+                table=table_name,
+                defaults={
+                    "source": path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": sha256,
+                },
             )
+        for loader in reversed(changed):
+            if delete_missing:
+                loader.delete_missing()
+            loader.close()
+    return [
+        result.stats() if isinstance(result, DeltaLoader) else result
+        for result in results.values()
+    ]
 
 
 def import_operations():
-    f = os.path.abspath(__file__).replace(
-        os.path.basename(__file__), "../data/info21.sql"
-    )
+    f = data_path("info21.sql")
     with open(f, "r", encoding="utf8") as file:
         with connection.cursor() as cursor:
             cursor.execute(file.read())
+    bump_version(CATALOG)
+    # Представления только что созданы по текущим данным
+    for status in matview_status():
+        mark_refreshed(status.name, status.version)
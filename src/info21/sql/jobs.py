@@ -0,0 +1,179 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .import_obj import IMPORT_FUNCS
+from .models import Job, JobStatus
+from .matviews import refresh_matviews
+from .procedures import Procedure, call_cached, get_procedure
+from .results import save_result
+from .stats import profile
+
+# Минимальный интервал между сохранениями прогресса задачи, с
+PROGRESS_INTERVAL = 1.0
+# Интервал отметок обработчика о выполняемой задаче и срок, после которого
+# задача без отметок считается брошенной (обработчик убит или упал), с
+HEARTBEAT_INTERVAL = 10
+JOB_LEASE = 60
+
+
+class JobProgress:
+    """Сохранение прогресса задачи в БД не чаще раза в PROGRESS_INTERVAL."""
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.saved = 0.0
+
+    def __call__(self, processed: int, fraction=None):
+        now = time.monotonic()
+        if now - self.saved < PROGRESS_INTERVAL:
+            return
+        self.saved = now
+        Job.objects.filter(pk=self.job.pk).update(
+            processed=processed, progress=fraction, heartbeat=timezone.now()
+        )
+
+
+class Heartbeat(threading.Thread):
+    """Отметка обработчика о выполняемой задаче раз в HEARTBEAT_INTERVAL.
+    Работает в отдельном потоке со своим соединением, поэтому отметки идут
+    и во время долгого запроса основного потока."""
+
+    def __init__(self, job: Job):
+        super().__init__(daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL):
+                Job.objects.filter(pk=self.job.pk, status=JobStatus.RUNNING).update(
+                    heartbeat=timezone.now()
+                )
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_import(job: Job, progress: JobProgress):
+    stats = IMPORT_FUNCS[job.params["table"]](on_progress=progress)
+    refresh_matviews()
+    return {"table": stats.table, "rows": stats.rows, "inserted": stats.inserted}
+
+
+def run_delete_table(job: Job, progress: JobProgress):
+    model = apps.get_model(app_label="sql", model_name=job.params["table"])
+    deleted, _ = model.objects.all().delete()
+    refresh_matviews()
+    return {"table": job.params["table"], "rows": deleted}
+
+
+def run_call(job: Job, progress: JobProgress):
+    procedure = get_procedure(job.params["name"])
+    explain = job.params.get("explain", False)
+    if procedure.matviews:
+        refresh_matviews(procedure.matviews)
+    # Вызов выполняется в собственной транзакции, поэтому запись о неудачном
+    # выполнении не откатывается вместе с ним
+    if explain:
+        # План снимается только при настоящем выполнении, без кэша
+        columns, rows = profiled_call(procedure, True)(procedure.name, job.params["params"])
+        cached = False
+    else:
+        columns, rows, cached = call_cached(
+            procedure, job.params["params"], profiled_call(procedure)
+        )
+    # В задаче хранится только ссылка на результат в хранилище
+    return {**save_result(columns, rows), "cached": cached}
+
+
+# Вызов процедуры или функции с записью в историю выполнений. Явный EXPLAIN
+# возможен только для функций, не изменяющих данные: CALL не объясняется
+def profiled_call(procedure: Procedure, explain: bool = False):
+    # utils ставит задачи в очередь, поэтому импортируется здесь
+    from .utils import call_func, call_proc
+
+    call = call_func if procedure.type == "FUNCTION" else call_proc
+
+    def run(name: str, params: list):
+        explain_sql = None
+        if procedure.type == "FUNCTION" and procedure.cacheable:
+            explain_sql = f"SELECT * FROM {name}({', '.join(['%s'] * len(params))})"
+        with profile(
+            name, procedure.type, params=params, explain=explain, explain_sql=explain_sql
+        ) as execution:
+            columns, rows = call(name, params)
+            execution.rows = len(rows)
+        return columns, rows
+
+    return run
+
+
+JOB_HANDLERS = {
+    "import": run_import,
+    "delete_table": run_delete_table,
+    "call": run_call,
+}
+
+
+def submit(kind: str, **params):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    return Job.objects.create(kind=kind, params=params)
+
+
+# Захват следующей задачи из очереди; SKIP LOCKED позволяет нескольким
+# обработчикам разбирать очередь без конфликтов
+def claim_next():
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=JobStatus.QUEUED)
+            .order_by("pk")
+            .first()
+        )
+        if job:
+            job.status = JobStatus.RUNNING
+            job.started = job.heartbeat = timezone.now()
+            job.save(update_fields=["status", "started", "heartbeat"])
+        return job
+
+
+# Задачи, обработчик которых перестал отмечаться дольше JOB_LEASE, завершаются
+# ошибкой: повторный запуск мог бы второй раз изменить данные. У задач,
+# запущенных до появления отметок, срок считается от запуска
+def fail_abandoned():
+    deadline = timezone.now() - timedelta(seconds=JOB_LEASE)
+    abandoned = Q(heartbeat__lt=deadline) | Q(heartbeat__isnull=True, started__lt=deadline)
+    return Job.objects.filter(abandoned, status=JobStatus.RUNNING).update(
+        status=JobStatus.FAILED,
+        error="Обработчик задачи остановился до ее завершения, запустите задачу еще раз.",
+        finished=timezone.now(),
+    )
+
+
+def run_job(job: Job):
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        result = JOB_HANDLERS[job.kind](job, JobProgress(job))
+    except Exception as err:
+        job.status, job.error = JobStatus.FAILED, str(err)
+    else:
+        job.status, job.result, job.progress = JobStatus.DONE, result, 1.0
+        if isinstance(result, dict) and "rows" in result:
+            rows = result["rows"]
+            job.processed = len(rows) if isinstance(rows, list) else rows
+    finally:
+        heartbeat.stop()
+    job.finished = job.heartbeat = timezone.now()
+    job.save()
+    return job
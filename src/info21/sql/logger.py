@@ -1,57 +1,234 @@
+import atexit
+import fcntl
+import json
 import logging
 import os
-from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import RequestTiming, current_timing, observe_request
+from .slowlog import flush as flush_slow_queries
+
+# Атрибуты, которые есть у любой записи журнала; остальные попадают в JSON
+RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message"}
+# Максимальное число записей, которые пишутся в файл за один раз
+LOG_BATCH = 500
+
+_lock = threading.Lock()
+_state = {"handler": None, "file_handler": None, "listener": None}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись журнала - одна строка JSON."""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(
+            (key, value) for key, value in vars(record).items() if key not in RECORD_ATTRS
+        )
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """Файл журнала, общий для всех процессов.
+
+    Запись и ротация выполняются под блокировкой flock отдельного файла.
+    Если файл уже ротирован другим процессом, он открывается заново.
+    """
+
+    def __init__(self, filename, max_bytes: int, backup_count: int):
+        super().__init__(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf8", delay=True
+        )
+        self.lock_path = self.baseFilename + ".lock"
+
+    def _reopen_if_rotated(self):
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if self.stream is not None and os.fstat(self.stream.fileno()).st_ino != current:
+            self.stream.close()
+            self.stream = None
+        if self.stream is None:
+            self.stream = self._open()
+
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        data = "".join(lines)
+        if not data:
+            return
+        with self.lock, open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_rotated()
+                size = os.fstat(self.stream.fileno()).st_size
+                if self.maxBytes and size and size + len(data.encode()) > self.maxBytes:
+                    self.doRollover()
+                    self._reopen_if_rotated()
+                self.stream.write(data)
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+
+class BatchingQueueListener(QueueListener):
+    """Фоновый поток, который забирает из очереди все накопившиеся записи
+    (не больше LOG_BATCH) и пишет их в файл одной операцией."""
+
+    def _monitor(self):
+        stop = False
+        while not stop:
+            batch = [self.dequeue(True)]
+            while len(batch) < LOG_BATCH:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            if self._sentinel in batch:
+                batch = batch[:batch.index(self._sentinel)]
+                stop = True
+            if batch:
+                self.handlers[0].emit_batch([self.prepare(record) for record in batch])
+
+
+def start_listener():
+    handler = _state["handler"]
+    handler.queue = queue.SimpleQueue()
+    listener = BatchingQueueListener(handler.queue, _state["file_handler"])
+    listener.start()
+    _state["listener"] = listener
+
+
+def stop_listener():
+    if _state["listener"] is not None:
+        _state["listener"].stop()
+        _state["listener"] = None
+
+
+# Логгер действий пользователя, один на процесс. Запросы только кладут
+# записи в очередь, в файл их пишет фоновый поток. После fork (например, в
+# рабочих процессах сервера) поток запускается заново
+def get_logger():
+    logger = logging.getLogger("user_actions")
+    with _lock:
+        if _state["handler"] is None:
+            os.makedirs(os.path.dirname(settings.LOG_FILE), exist_ok=True)
+            file_handler = SharedRotatingFileHandler(
+                settings.LOG_FILE, settings.LOG_MAX_BYTES, settings.LOG_BACKUP_COUNT
+            )
+            file_handler.setFormatter(JsonFormatter())
+            _state["file_handler"] = file_handler
+            _state["handler"] = QueueHandler(queue.SimpleQueue())
+            logger.setLevel(logging.DEBUG)
+            logger.addHandler(_state["handler"])
+            start_listener()
+            atexit.register(stop_listener)
+            os.register_at_fork(after_in_child=start_listener)
+    return logger
+
+
+class LoggedStream:
+    """Содержимое потокового ответа с подсчетом отправленных байт. Django
+    вызывает close() при закрытии ответа, даже если клиент отключился."""
+
+    def __init__(self, middleware, request, response, timing):
+        self.content = response.streaming_content
+        self.args = (request, response, timing)
+        self.middleware = middleware
+        self.size = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.content:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        request, response, timing = self.args
+        connection.execute_wrappers.remove(timing)
+        self.middleware.log(request, response, timing, self.size)
 
 
 class LoggingMiddleware:
     """Класс логгера."""
 
     def __init__(self, get_response):
-        # Создаем и настраиваем логгер
         self.get_response = get_response
-        log_format = "%(asctime)s [%(levelname)s] %(message)s"
-        self.logger = logging.getLogger("user_actions")
-        self.logger.setLevel(logging.DEBUG)
-        now = datetime.now().strftime("%d-%m-%y-%H-%M-%S")
-        logs_dir = os.path.abspath(__file__).replace(
-            os.path.basename(__file__), "../logs/"
-        )
-        if not os.path.exists("logs"):
-            os.mkdir("logs")
-        log_filename = f"{logs_dir}logs_{now}.log"
-        file_handler = TimedRotatingFileHandler(log_filename)
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(logging.Formatter(log_format))
-        self.logger.addHandler(file_handler)
+        self.logger = get_logger()
 
     def __call__(self, request):
         # Логгирование действий пользователя с помощью методов info, error и
         # warning, в зависимости от статуса ответа на запрос
         request.logger = self.logger
-        response = self.get_response(request)
-        if response.status_code == 200:
-            self.logger.info(
-                "%s %s %s %s",
-                request.method,
-                request.path,
-                response.status_code,
-                request.META.get("REMOTE_ADDR"),
-            )
-        elif response.status_code >= 500:
-            self.logger.error(
-                "%s %s %s %s",
-                request.method,
-                request.path,
-                response.status_code,
-                request.META.get("REMOTE_ADDR"),
-            )
+        timing = RequestTiming(request)
+        connection.execute_wrappers.append(timing)
+        token = current_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            connection.execute_wrappers.remove(timing)
+            raise
+        finally:
+            current_timing.reset(token)
+        # Для потокового ответа заголовок содержит время до начала отправки
+        response["Server-Timing"] = timing.server_timing()
+        # Потоковый ответ записывается в журнал, когда сервер его закрывает
+        if response.streaming:
+            response.streaming_content = LoggedStream(self, request, response, timing)
         else:
-            self.logger.warning(
-                "%s %s %s %s",
-                request.method,
-                request.path,
-                response.status_code,
-                request.META.get("REMOTE_ADDR"),
-            )
+            connection.execute_wrappers.remove(timing)
+            self.log(request, response, timing, len(response.content))
         return response
+
+    def log(self, request, response, timing, size):
+        observe_request(request, response, timing)
+        flush_slow_queries()
+        if response.status_code < 400:
+            level = logging.INFO
+        elif response.status_code >= 500:
+            level = logging.ERROR
+        else:
+            level = logging.WARNING
+        self.logger.log(
+            level,
+            "%s %s %s %s",
+            request.method,
+            request.path,
+            response.status_code,
+            request.META.get("REMOTE_ADDR"),
+            extra={
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(timing.total * 1000, 2),
+                "db_ms": round(timing.db * 1000, 2),
+                "template_ms": round(timing.template * 1000, 2),
+                "queries": timing.queries,
+                "size": size,
+                "remote_addr": request.META.get("REMOTE_ADDR"),
+            },
+        )
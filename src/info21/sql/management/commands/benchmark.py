@@ -0,0 +1,113 @@
+import http.client
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Страницы по умолчанию: чтение таблицы, список операций и API
+DEFAULT_PATHS = ["/data/Peers/read", "/operation/", "/api/Peers/"]
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест запущенного сервера: запросы к страницам из "
+        "нескольких потоков с постоянными соединениями."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*", help="Пути страниц; по умолчанию чтение Peers, операции и API."
+        )
+        parser.add_argument(
+            "--url", default="http://127.0.0.1:8000", help="Адрес сервера."
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=16, help="Число одновременных клиентов."
+        )
+        parser.add_argument(
+            "--duration", type=float, default=30, help="Длительность теста, с."
+        )
+        parser.add_argument(
+            "--warmup", type=float, default=3, help="Прогрев перед замером, с."
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        if url.scheme != "http" or not url.hostname:
+            raise CommandError(f"Неверный адрес сервера: {options['url']}")
+        paths = options["paths"] or DEFAULT_PATHS
+        self.run(url, paths, options["concurrency"], options["warmup"])
+        latencies, statuses, elapsed = self.run(
+            url, paths, options["concurrency"], options["duration"]
+        )
+        latencies.sort()
+        total = len(latencies)
+        errors = sum(count for status, count in statuses.items() if not 200 <= status < 400)
+        self.stdout.write(
+            f"{options['url']} {', '.join(paths)}: клиентов {options['concurrency']}, "
+            f"{elapsed:.1f} с"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Запросов: {total}, в секунду: {total / elapsed:.1f}")
+        )
+        self.stdout.write(
+            f"Время ответа, мс: p50 {percentile(latencies, 0.5) * 1000:.1f}, "
+            f"p95 {percentile(latencies, 0.95) * 1000:.1f}, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.1f}, "
+            f"максимум {(latencies[-1] if latencies else 0) * 1000:.1f}"
+        )
+        statuses_text = ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items()))
+        if errors:
+            self.stdout.write(self.style.WARNING(f"Ошибок: {errors} ({statuses_text})"))
+        else:
+            self.stdout.write(f"Статусы: {statuses_text}")
+
+    # Каждый клиент по кругу запрашивает страницы через одно соединение
+    # keep-alive, пока не истечет время; ошибка соединения - статус 0
+    def run(self, url, paths: list, concurrency: int, duration: float):
+        lock = threading.Lock()
+        latencies, statuses = [], Counter()
+        stop = time.monotonic() + duration
+
+        # Если сервер закрыл простаивающее соединение (например, при
+        # перезапуске процесса), запрос повторяется в новом, как в браузере
+        def request(conn, path: str, retry: bool = True):
+            reused = conn.sock is not None
+            try:
+                conn.request("GET", path, headers={"Host": url.netloc})
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                return request(conn, path, retry=False) if retry and reused else 0
+            if response.will_close:
+                conn.close()
+            return response.status
+
+        def client(number: int):
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+            i = number
+            while time.monotonic() < stop:
+                path = paths[i % len(paths)]
+                i += 1
+                start = time.perf_counter()
+                status = request(conn, path)
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency)
+                    statuses[status] += 1
+            conn.close()
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(client, range(concurrency)))
+        return latencies, statuses, time.monotonic() - start
@@ -0,0 +1,20 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from sql.export_obj import write_snapshot
+from sql.import_obj import import_order
+
+
+class Command(BaseCommand):
+    help = "Экспорт всех таблиц из одного снимка БД в ZIP-архив CSV-файлов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Путь к создаваемому ZIP-архиву.")
+
+    def handle(self, *args, **options):
+        models = [
+            apps.get_model(app_label="sql", model_name=name) for name in import_order()
+        ]
+        with open(options["output"], "wb") as file:
+            write_snapshot(file, models)
+        self.stdout.write(self.style.SUCCESS(f"Архив {options['output']} создан."))
@@ -1,28 +1,122 @@
-from django.core.management.base import BaseCommand
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
-from sql.import_obj import (import_checks, import_friends, import_operations,
-                            import_p2p, import_peers, import_recommendations,
-                            import_tasks, import_time_tracking,
-                            import_transferred_points, import_verter,
-                            import_xp)
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from sql.import_obj import (BATCH_SIZE, import_delta, import_dependencies,
+                            import_operations, import_order, run_import)
+from sql.metrics import flush
+from sql.slowlog import flush as flush_slow_queries
+
+
+def init_worker():
+    # Каждый процесс пула открывает собственное соединение с БД
+    django.setup()
+    connections.close_all()
+
+
+# Задача процесса пула. Процессы пула завершаются через os._exit без
+# обработчиков atexit, поэтому медленные запросы и метрики сохраняются
+# после каждой таблицы
+def import_worker(table_name: str, batch_size: int, archive=None):
+    try:
+        return run_import(table_name, batch_size, archive)
+    finally:
+        flush_slow_queries()
+        flush()
 
 
 class Command(BaseCommand):
     help = "Импорт данных из CSV-файлов в БД."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Количество строк, загружаемых за одну транзакцию.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Количество процессов, загружающих независимые таблицы параллельно.",
+        )
+        parser.add_argument(
+            "--archive",
+            help="ZIP-архив, созданный export_data, вместо файлов из data/.",
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help=(
+                "Загрузить только изменившиеся файлы и строки. Выполняется в "
+                "одной транзакции."
+            ),
+        )
+        parser.add_argument(
+            "--delete-missing",
+            action="store_true",
+            help=(
+                "С --delta: удалить строки, которых нет в изменившихся файлах. "
+                "Строки, на которые ссылаются другие таблицы, остаются."
+            ),
+        )
+
     def handle(self, *args, **options):
+        if options["delta"] and options["archive"]:
+            raise CommandError("Инкрементальный импорт из архива не поддерживается.")
+        if options["delete_missing"] and not options["delta"]:
+            raise CommandError("--delete-missing используется только с --delta.")
+        started = time.monotonic()
         try:
-            import_peers()
-            import_tasks()
-            import_checks()
-            import_p2p()
-            import_verter()
-            import_transferred_points()
-            import_friends()
-            import_recommendations()
-            import_xp()
-            import_time_tracking()
+            if options["delta"]:
+                for stats in import_delta(options["batch_size"], options["delete_missing"]):
+                    self.stdout.write(str(stats))
+            elif options["workers"] > 1:
+                self.import_parallel(
+                    options["workers"], options["batch_size"], options["archive"]
+                )
+            else:
+                for table_name in import_order():
+                    self.stdout.write(
+                        str(run_import(table_name, options["batch_size"], options["archive"]))
+                    )
             import_operations()
-            self.stdout.write(self.style.SUCCESS("Данные успешно загружены в БД."))
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "Данные успешно загружены в БД за "
+                    f"{time.monotonic() - started:.2f} с."
+                )
+            )
         except Exception as error:
             raise Exception("Ошибка при импорте данных:", error)
+
+    def import_parallel(self, workers: int, batch_size: int, archive=None):
+        # Таблица запускается, как только загружены все таблицы, на которые она ссылается
+        pending = import_dependencies()
+        done, running = set(), {}
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker,
+        ) as pool:
+            while pending or running:
+                for table_name in [t for t, deps in pending.items() if deps <= done]:
+                    del pending[table_name]
+                    running[
+                        pool.submit(import_worker, table_name, batch_size, archive)
+                    ] = table_name
+                if not running:
+                    raise ValueError(
+                        f"Циклическая зависимость таблиц: {', '.join(pending)}"
+                    )
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done.add(running.pop(future))
+                    self.stdout.write(str(future.result()))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from sql.matviews import matview_status, refresh_matviews
+
+
+class Command(BaseCommand):
+    help = "Состояние и обновление материализованных представлений отчетов."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names", nargs="*", help="Представления; по умолчанию все."
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Обновить устаревшие представления.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Обновить представления, даже если они не устарели.",
+        )
+
+    def handle(self, *args, **options):
+        names = options["names"] or None
+        if options["refresh"] or options["force"]:
+            refreshed = refresh_matviews(names, force=options["force"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Обновлено представлений: {len(refreshed)} {', '.join(refreshed)}"
+                )
+            )
+        for status in matview_status(names):
+            state = (
+                self.style.WARNING("устарело") if status.stale else self.style.SUCCESS("актуально")
+            )
+            self.stdout.write(
+                f"{status.name}: {state}, таблицы {', '.join(sorted(status.tables))}, "
+                f"обновлено {status.refreshed or 'никогда'}"
+            )
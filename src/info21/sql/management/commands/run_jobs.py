@@ -0,0 +1,89 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from sql.jobs import JOB_LEASE, claim_next, fail_abandoned, run_job
+from sql.matviews import refresh_matviews
+from sql.metrics import flush
+from sql.results import purge_results
+from sql.slowlog import flush as flush_slow_queries
+from sql.slowlog import prune_slow_queries
+from sql.stats import prune_executions
+
+# Интервал очистки устаревших результатов, истории выполнений и медленных
+# запросов, с
+CLEANUP_INTERVAL = 60 * 60
+# Интервал проверки материализованных представлений, с. Версии таблиц
+# увеличивают триггеры при любой записи, в том числе не через приложение,
+# поэтому устаревшие представления обновляются здесь в фоне
+MATVIEW_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = "Обработчик очереди фоновых задач."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Пауза между проверками пустой очереди, с.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить все задачи из очереди и завершиться.",
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Текущая задача дорабатывает до конца, новые не запускаются
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        next_cleanup = next_refresh = next_lease = 0.0
+        while not self.stopping:
+            close_old_connections()
+            if time.monotonic() >= next_lease:
+                self.fail_abandoned()
+                next_lease = time.monotonic() + JOB_LEASE
+            job = claim_next()
+            if job is None:
+                if options["once"]:
+                    break
+                if time.monotonic() >= next_refresh:
+                    self.refresh_matviews()
+                    next_refresh = time.monotonic() + MATVIEW_INTERVAL
+                if time.monotonic() >= next_cleanup:
+                    prune_executions()
+                    prune_slow_queries()
+                    purge_results()
+                    next_cleanup = time.monotonic() + CLEANUP_INTERVAL
+                time.sleep(options["poll_interval"])
+                continue
+            job = run_job(job)
+            flush()
+            flush_slow_queries()
+            message = f"{job}: {job.get_status_display()} за {job.elapsed:.2f} с"
+            if job.error:
+                self.stderr.write(f"{message}: {job.error}")
+            else:
+                self.stdout.write(message)
+
+    def fail_abandoned(self):
+        failed = fail_abandoned()
+        if failed:
+            self.stderr.write(f"Брошенных задач завершено с ошибкой: {failed}")
+
+    def refresh_matviews(self):
+        try:
+            refreshed = refresh_matviews()
+        except DatabaseError as err:
+            self.stderr.write(f"Ошибка обновления представлений: {err}")
+            return
+        if refreshed:
+            self.stdout.write(f"Обновлены представления: {', '.join(refreshed)}")
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from sql.models import SlowQuery
+from sql.slowlog import SLOW_ORDER, slow_queries
+
+
+class Command(BaseCommand):
+    help = "Медленные запросы к БД, сгруппированные по нормализованному тексту."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--order",
+            choices=list(SLOW_ORDER),
+            default="total",
+            help="Сортировка: общее время, максимум, выполнения или последние.",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Сколько запросов вывести."
+        )
+        parser.add_argument(
+            "--stack", action="store_true", help="Выводить стек вызовов."
+        )
+        parser.add_argument(
+            "--clear", action="store_true", help="Удалить сохраненные запросы."
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"Удалено запросов: {deleted}"))
+            return
+        for query in slow_queries(options["order"], options["limit"]):
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{query.calls} раз, всего {query.total_duration:.1f} мс, "
+                    f"в среднем {query.avg_duration:.1f} мс, "
+                    f"максимум {query.max_duration:.1f} мс"
+                )
+            )
+            self.stdout.write(f"  {query.sql}")
+            self.stdout.write(f"  {query.view or '-'}: {query.caller or '-'}")
+            if options["stack"] and query.stack:
+                for frame in query.stack.splitlines():
+                    self.stdout.write(f"    {frame}")
@@ -0,0 +1,96 @@
+from typing import NamedTuple
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import TableVersion
+from .procedures import get_procedures, mentions
+from .registry import DATA_TABLES
+from .versions import table_versions
+
+
+class MatviewStatus(NamedTuple):
+    """Состояние материализованного представления.
+
+    Версия представления в TableVersions - сумма версий его таблиц на момент
+    обновления. Версии таблиц только растут, поэтому представление
+    устарело, если сумма текущих версий от нее отличается.
+    """
+
+    name: str
+    tables: frozenset
+    version: int
+    refreshed_version: int
+    refreshed: object
+
+    @property
+    def stale(self):
+        return self.refreshed_version != self.version
+
+
+# Материализованные представления из info21.sql и таблицы, из которых они строятся
+def matview_tables():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT matviewname, definition FROM pg_matviews WHERE schemaname = 'public'"
+        )
+        return {
+            name: frozenset(table for table in DATA_TABLES if mentions(definition, table))
+            for name, definition in cursor.fetchall()
+        }
+
+
+def matview_status(names=None):
+    matviews = {
+        name: tables
+        for name, tables in matview_tables().items()
+        if names is None or name in names
+    }
+    versions = table_versions(set(DATA_TABLES) | set(matviews))
+    result = []
+    for name, tables in sorted(matviews.items()):
+        refreshed_version, refreshed = versions.get(name, (None, None))
+        result.append(
+            MatviewStatus(
+                name,
+                tables,
+                sum(versions.get(table, (0, None))[0] for table in tables),
+                refreshed_version,
+                refreshed,
+            )
+        )
+    return result
+
+
+def mark_refreshed(name: str, version: int):
+    TableVersion.objects.update_or_create(
+        table=name, defaults={"version": version, "modified": timezone.now()}
+    )
+
+
+# Обновление устаревших представлений без блокировки чтения. Версии таблиц
+# читаются до обновления, поэтому изменения, сделанные во время него,
+# обновят представление в следующий раз
+def refresh_matviews(names=None, force: bool = False):
+    refreshed = []
+    for status in matview_status(names):
+        if not (force or status.stale):
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "REFRESH MATERIALIZED VIEW CONCURRENTLY "
+                + connection.ops.quote_name(status.name)
+            )
+        mark_refreshed(status.name, status.version)
+        refreshed.append(status.name)
+    return refreshed
+
+
+# Представления, которые читает произвольный запрос: напрямую или через
+# упомянутые в нем процедуры и функции
+def query_matviews(query: str):
+    names = {name for name in matview_tables() if mentions(query, name)}
+    for name, procedure in get_procedures().items():
+        if procedure.matviews and mentions(query, name):
+            names |= procedure.matviews
+    return frozenset(names)
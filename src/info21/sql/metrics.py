@@ -0,0 +1,336 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+# Границы корзин гистограмм, с
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HISTOGRAMS = {
+    "info21_request_duration_seconds": (
+        "Время обработки запроса по имени URL и таблице или процедуре",
+        ("view", "target"),
+    ),
+    "info21_routine_duration_seconds": (
+        "Время выполнения процедур, функций и SQL-запросов",
+        ("routine", "kind"),
+    ),
+}
+COUNTERS = {
+    "info21_request_db_seconds_total": ("Время запросов к БД", ("view",)),
+    "info21_request_queries_total": ("Число запросов к БД", ("view",)),
+    "info21_result_cache_total": (
+        "Обращения к кэшу результатов процедур: hits, misses, skipped",
+        ("result",),
+    ),
+}
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Сумма значений завершившихся процессов
+ARCHIVE = "exited.json"
+
+# Замеры текущего запроса, None вне запроса
+current_timing = ContextVar("current_timing", default=None)
+
+_lock = threading.Lock()
+_state = {"values": {}, "flushed": 0.0, "written": False}
+
+
+class RequestTiming:
+    """Замеры запроса: общее время, время и число запросов к БД (через
+    execute_wrapper) и время отрисовки шаблонов."""
+
+    def __init__(self, request=None):
+        self.request = request
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - start
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f"tpl;dur={self.template * 1000:.1f}, total;dur={self.total * 1000:.1f}"
+        )
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timing = current_timing.get()
+        if timing is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timing.template += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблоны Django с замером времени отрисовки для Server-Timing.
+    Вложенные шаблоны ({% include %}) входят во время внешнего."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def observe(name: str, labels: tuple, value: float):
+    if not settings.METRICS_ENABLED:
+        return
+    with _lock:
+        values = _state["values"].setdefault((name, labels), [0] * (len(BUCKETS) + 1) + [0.0])
+        values[bisect_left(BUCKETS, value)] += 1
+        values[-1] += value
+    flush(force=False)
+
+
+def inc(name: str, labels: tuple, value: float = 1):
+    if not settings.METRICS_ENABLED:
+        return
+    with _lock:
+        values = _state["values"].setdefault((name, labels), [0])
+        values[0] += value
+    flush(force=False)
+
+
+# Таблица или процедура запроса для метки target. Берутся только
+# существующие, чтобы произвольные URL не создавали новых рядов метрик
+def request_target(request, response):
+    from .procedures import get_procedures
+    from .registry import get_table
+
+    match = request.resolver_match
+    if match is None or response.status_code >= 400:
+        return ""
+    if "table" in match.kwargs:
+        try:
+            get_table(match.kwargs["table"])
+        except LookupError:
+            return ""
+        return match.kwargs["table"]
+    if "name" in match.kwargs:
+        return match.kwargs["name"] if match.kwargs["name"] in get_procedures() else ""
+    return ""
+
+
+def observe_request(request, response, timing: RequestTiming):
+    match = request.resolver_match
+    view = match.view_name if match else "unmatched"
+    target = request_target(request, response)
+    observe("info21_request_duration_seconds", (view, target), timing.total)
+    inc("info21_request_db_seconds_total", (view,), timing.db)
+    inc("info21_request_queries_total", (view,), timing.queries)
+
+
+def snapshot_path():
+    return os.path.join(settings.METRICS_DIR, f"{socket.gethostname()}-{os.getpid()}.json")
+
+
+def archive_path():
+    return os.path.join(settings.METRICS_DIR, ARCHIVE)
+
+
+def snapshot_data():
+    with _lock:
+        return [[name, list(labels), list(values)] for (name, labels), values in _state["values"].items()]
+
+
+def read_snapshot(path: str):
+    try:
+        with open(path, encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def write_snapshot(path: str, data: list):
+    with tempfile.NamedTemporaryFile("w", dir=settings.METRICS_DIR, delete=False) as f:
+        json.dump(data, f)
+    os.replace(f.name, path)
+
+
+def add_values(total: dict, data: list):
+    for name, labels, values in data:
+        current = total.setdefault((name, tuple(labels)), [0] * len(values))
+        for i, value in enumerate(values):
+            current[i] += value
+
+
+# Файлы снимков меняются под блокировкой: иначе /metrics мог бы посчитать
+# значения завершившегося процесса дважды или не посчитать совсем
+@contextmanager
+def snapshots_locked():
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+# Значения завершившихся процессов добавляются в общий файл ARCHIVE, а их
+# файлы удаляются: каталог не растет при перезапуске процессов, а суммы
+# счетчиков не уменьшаются. Вызывается под snapshots_locked
+def retire(paths: list, data: list = ()):
+    total = {}
+    add_values(total, read_snapshot(archive_path()))
+    for path in paths:
+        add_values(total, read_snapshot(path))
+    add_values(total, data)
+    write_snapshot(archive_path(), [[name, list(labels), values] for (name, labels), values in total.items()])
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Снимок процесса этого же хоста, который уже завершился (например, убит
+# по SIGKILL и не успел перенести свои значения)
+def is_dead(path: str):
+    host, _, pid = os.path.basename(path)[:-len(".json")].rpartition("-")
+    if host != socket.gethostname() or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+# Значения процесса сохраняются в общий каталог не чаще раза в
+# METRICS_FLUSH_INTERVAL, чтобы /metrics в любом процессе видел все. Файл с
+# тем же именем, оставшийся от завершившегося процесса с тем же PID,
+# сначала переносится в ARCHIVE
+def flush(force: bool = True):
+    now = time.monotonic()
+    if not force and now - _state["flushed"] < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _state["flushed"] = now
+    data = snapshot_data()
+    if not data:
+        return
+    try:
+        if not _state["written"]:
+            with snapshots_locked():
+                if os.path.exists(snapshot_path()):
+                    retire([snapshot_path()])
+            _state["written"] = True
+        write_snapshot(snapshot_path(), data)
+    except OSError:
+        pass
+
+
+# При завершении процесса его значения переносятся в ARCHIVE из памяти:
+# файл процесса содержит их же или более старые
+def retire_process():
+    data = snapshot_data()
+    if not data:
+        return
+    try:
+        with snapshots_locked():
+            retire([], data)
+            if _state["written"]:
+                os.remove(snapshot_path())
+    except OSError:
+        pass
+
+
+# Дочерний процесс после fork начинает с пустыми значениями, иначе
+# значения родителя были бы посчитаны дважды
+def reset_process():
+    _state.update(values={}, flushed=0.0, written=False)
+
+
+atexit.register(retire_process)
+os.register_at_fork(after_in_child=reset_process)
+
+
+# Сумма значений всех процессов; значения текущего процесса берутся из
+# памяти, а файл с его именем до первого сохранения - от прежнего процесса
+def collect():
+    own = snapshot_path()
+    total = {}
+    try:
+        collect_files(own, total)
+    except OSError:
+        pass
+    add_values(total, snapshot_data())
+    return total
+
+
+def collect_files(own: str, total: dict):
+    with snapshots_locked():
+        paths = [
+            path
+            for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json"))
+            if path != archive_path() and (path != own or not _state["written"])
+        ]
+        dead = [path for path in paths if is_dead(path)]
+        if dead:
+            retire(dead)
+        for path in [archive_path(), *(path for path in paths if path not in dead)]:
+            add_values(total, read_snapshot(path))
+
+
+def escape(value: str):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+# Текстовый формат Prometheus
+def render_metrics():
+    values = collect()
+    lines = []
+    for name, (description, label_names) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        for (metric, labels), data in sorted(values.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), data[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{format_labels(label_names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(label_names, labels)} {data[-1]}")
+            lines.append(f"{name}_count{format_labels(label_names, labels)} {cumulative}")
+    for name, (description, label_names) in COUNTERS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        for (metric, labels), data in sorted(values.items()):
+            if metric == name:
+                lines.append(f"{name}{format_labels(label_names, labels)} {data[0]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.10 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportFingerprint',
+            fields=[
+                ('table', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Таблица')),
+                ('source', models.CharField(max_length=1024, verbose_name='Файл')),
+                ('size', models.BigIntegerField(verbose_name='Размер файла')),
+                ('mtime', models.FloatField(verbose_name='Время изменения файла')),
+                ('sha256', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('imported', models.DateTimeField(auto_now=True, verbose_name='Дата загрузки')),
+            ],
+            options={
+                'verbose_name': 'Отпечаток файла импорта',
+                'verbose_name_plural': 'Отпечатки файлов импорта',
+                'db_table': 'ImportFingerprints',
+            },
+        ),
+    ]
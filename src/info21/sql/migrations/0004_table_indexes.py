@@ -0,0 +1,25 @@
+# Generated by Django 4.2.10 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql', '0003_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checks',
+            index=models.Index(fields=['date'], name='checks_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='p2p',
+            index=models.Index(fields=['check_2p2', 'state'], name='p2p_check_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timetracking',
+            index=models.Index(fields=['peer', 'date'], name='timetracking_peer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.10 on 2026-10-18 17:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+TABLES = [
+    "Peers",
+    "Tasks",
+    "Checks",
+    "P2P",
+    "Verter",
+    "TransferredPoints",
+    "Friends",
+    "Recommendations",
+    "XP",
+    "TimeTracking",
+]
+
+BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "TableVersions" ("table", "version", "modified")
+    VALUES (TG_TABLE_NAME, 1, clock_timestamp())
+    ON CONFLICT ("table") DO UPDATE
+    SET "version" = "TableVersions"."version" + 1, "modified" = clock_timestamp();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGER = """
+CREATE TRIGGER "{0}_version"
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{0}"
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+INSERT INTO "TableVersions" ("table", "version", "modified")
+VALUES ('{0}', 1, clock_timestamp()) ON CONFLICT DO NOTHING;
+"""
+
+DROP_TRIGGER = 'DROP TRIGGER IF EXISTS "{0}_version" ON "{0}";'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql', '0004_table_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('table', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Таблица')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Версия')),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Версия таблицы',
+                'verbose_name_plural': 'Версии таблиц',
+                'db_table': 'TableVersions',
+            },
+        ),
+        migrations.RunSQL(
+            BUMP_FUNCTION, "DROP FUNCTION IF EXISTS bump_table_version();"
+        ),
+        migrations.RunSQL(
+            [CREATE_TRIGGER.format(table) for table in TABLES],
+            [DROP_TRIGGER.format(table) for table in TABLES],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.10 on 2026-10-18 17:37
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql', '0005_tableversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Execution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('routine', models.CharField(max_length=255, verbose_name='Процедура или функция')),
+                ('kind', models.CharField(max_length=16, verbose_name='Тип')),
+                ('query', models.TextField(blank=True, verbose_name='Запрос')),
+                ('params', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Параметры')),
+                ('duration', models.FloatField(verbose_name='Время выполнения, мс')),
+                ('rows', models.BigIntegerField(null=True, verbose_name='Строк в результате')),
+                ('shared_hit', models.BigIntegerField(null=True, verbose_name='Буферов найдено в кэше')),
+                ('shared_read', models.BigIntegerField(null=True, verbose_name='Буферов прочитано')),
+                ('plan', models.JSONField(null=True, verbose_name='План выполнения')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата выполнения')),
+            ],
+            options={
+                'verbose_name': 'Выполнение запроса',
+                'verbose_name_plural': 'Выполнения запросов',
+                'db_table': 'Executions',
+                'indexes': [models.Index(fields=['routine', '-created'], name='executions_routine_idx'), models.Index(fields=['created'], name='executions_created_idx')],
+            },
+        ),
+    ]
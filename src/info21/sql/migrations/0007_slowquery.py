@@ -0,0 +1,40 @@
+# Generated by Django 4.2.10 on 2026-10-18 17:47
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql', '0006_execution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True, verbose_name='Отпечаток')),
+                ('sql', models.TextField(verbose_name='Нормализованный запрос')),
+                ('example', models.TextField(verbose_name='Пример запроса')),
+                ('params', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='Параметры')),
+                ('view', models.CharField(blank=True, max_length=255, verbose_name='Страница или команда')),
+                ('caller', models.CharField(blank=True, max_length=255, verbose_name='Место вызова')),
+                ('stack', models.TextField(blank=True, verbose_name='Стек вызовов')),
+                ('calls', models.BigIntegerField(default=0, verbose_name='Выполнений')),
+                ('total_duration', models.FloatField(default=0, verbose_name='Общее время, мс')),
+                ('max_duration', models.FloatField(default=0, verbose_name='Максимальное время, мс')),
+                ('rows', models.BigIntegerField(null=True, verbose_name='Строк')),
+                ('first_seen', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Первое выполнение')),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последнее выполнение')),
+            ],
+            options={
+                'verbose_name': 'Медленный запрос',
+                'verbose_name_plural': 'Медленные запросы',
+                'db_table': 'SlowQueries',
+                'indexes': [models.Index(fields=['last_seen'], name='slow_queries_last_seen_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql', '0007_slowquery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat',
+            field=models.DateTimeField(null=True, verbose_name='Отметка обработчика'),
+        ),
+    ]
@@ -1,8 +1,10 @@
 import re
 
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import Index, UniqueConstraint
+from django.utils import timezone
 
 
 class Peers(models.Model):
@@ -83,7 +85,7 @@ class Checks(models.Model):
     date = models.DateField("Дата проверки", db_column="Date", null=True)
 
     def __str__(self):
-        return self.task.title
+        return self.task_id
 
     class Meta:
         db_table = "Checks"
@@ -92,6 +94,8 @@ class Checks(models.Model):
         constraints = [
             UniqueConstraint(fields=["peer", "task", "date"], name="unique_check")
         ]
+        # Поиск проверок пира по заданию покрывает уникальный индекс unique_check
+        indexes = [Index(fields=["date"], name="checks_date_idx")]
 
 
 class CheckStatus(models.TextChoices):
@@ -129,6 +133,7 @@ class P2P(models.Model):
                 name="unique_p2p",
             )
         ]
+        indexes = [Index(fields=["check_2p2", "state"], name="p2p_check_state_idx")]
 
 
 class Verter(models.Model):
@@ -264,7 +269,160 @@ class TimeTracking(models.Model):
         db_table = "TimeTracking"
         verbose_name = "Посещение кампуса"
         verbose_name_plural = "Посещения кампуса"
+        indexes = [Index(fields=["peer", "date"], name="timetracking_peer_date_idx")]
 
     def clean(self):
         if self.state not in [1, 2]:
             raise ValidationError("Состояние может быть равно 1 или 2!")
+
+
+class ImportFingerprint(models.Model):
+    """Отпечатки CSV-файлов, загруженных инкрементальным импортом."""
+
+    table = models.CharField("Таблица", primary_key=True, max_length=255)
+    source = models.CharField("Файл", max_length=1024)
+    size = models.BigIntegerField("Размер файла")
+    mtime = models.FloatField("Время изменения файла")
+    sha256 = models.CharField("SHA-256", max_length=64)
+    imported = models.DateTimeField("Дата загрузки", auto_now=True)
+
+    def __str__(self):
+        return self.table
+
+    class Meta:
+        db_table = "ImportFingerprints"
+        verbose_name = "Отпечаток файла импорта"
+        verbose_name_plural = "Отпечатки файлов импорта"
+
+
+class JobStatus(models.TextChoices):
+    """Статус фоновой задачи."""
+
+    QUEUED = "queued", "В очереди"
+    RUNNING = "running", "Выполняется"
+    DONE = "done", "Завершена"
+    FAILED = "failed", "Ошибка"
+
+
+class Job(models.Model):
+    """Фоновые задачи: импорт, удаление таблиц и вызов процедур."""
+
+    kind = models.CharField("Тип задачи", max_length=32)
+    params = models.JSONField("Параметры", default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(
+        "Статус",
+        max_length=10,
+        choices=JobStatus.choices,
+        default=JobStatus.QUEUED,
+        db_index=True,
+    )
+    processed = models.BigIntegerField("Обработано строк", default=0)
+    progress = models.FloatField("Доля выполнения", null=True)
+    result = models.JSONField("Результат", null=True, encoder=DjangoJSONEncoder)
+    error = models.TextField("Ошибка", blank=True)
+    created = models.DateTimeField("Создана", auto_now_add=True)
+    started = models.DateTimeField("Запущена", null=True)
+    heartbeat = models.DateTimeField("Отметка обработчика", null=True)
+    finished = models.DateTimeField("Завершена", null=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk}"
+
+    class Meta:
+        db_table = "Jobs"
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+
+    @property
+    def elapsed(self):
+        if not self.started:
+            return None
+        return ((self.finished or timezone.now()) - self.started).total_seconds()
+
+    @property
+    def eta(self):
+        if self.status != JobStatus.RUNNING or not self.progress:
+            return None
+        return self.elapsed * (1 - self.progress) / self.progress
+
+
+class TableVersion(models.Model):
+    """Версии таблиц с данными.
+
+    Версия увеличивается триггером БД после каждого изменяющего таблицу
+    оператора, включая COPY при импорте, каскадное удаление и процедуры.
+    """
+
+    table = models.CharField("Таблица", primary_key=True, max_length=255)
+    version = models.BigIntegerField("Версия", default=0)
+    modified = models.DateTimeField("Дата изменения", default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+    class Meta:
+        db_table = "TableVersions"
+        verbose_name = "Версия таблицы"
+        verbose_name_plural = "Версии таблиц"
+
+
+class Execution(models.Model):
+    """История выполнения процедур, функций и произвольных SQL-запросов.
+
+    Буферы берутся из сохраненных планов, поэтому известны только для
+    выполнений с планом.
+    """
+
+    routine = models.CharField("Процедура или функция", max_length=255)
+    kind = models.CharField("Тип", max_length=16)
+    query = models.TextField("Запрос", blank=True)
+    params = models.JSONField("Параметры", default=list, encoder=DjangoJSONEncoder)
+    duration = models.FloatField("Время выполнения, мс")
+    rows = models.BigIntegerField("Строк в результате", null=True)
+    shared_hit = models.BigIntegerField("Буферов найдено в кэше", null=True)
+    shared_read = models.BigIntegerField("Буферов прочитано", null=True)
+    plan = models.JSONField("План выполнения", null=True)
+    error = models.TextField("Ошибка", blank=True)
+    created = models.DateTimeField("Дата выполнения", default=timezone.now)
+
+    def __str__(self):
+        return f"{self.routine} {self.duration:.1f} мс"
+
+    class Meta:
+        db_table = "Executions"
+        verbose_name = "Выполнение запроса"
+        verbose_name_plural = "Выполнения запросов"
+        indexes = [
+            Index(fields=["routine", "-created"], name="executions_routine_idx"),
+            Index(fields=["created"], name="executions_created_idx"),
+        ]
+
+
+class SlowQuery(models.Model):
+    """Медленные SQL-запросы, сгруппированные по нормализованному тексту.
+
+    Пример запроса, параметры и место вызова - последнего из медленных.
+    """
+
+    fingerprint = models.CharField("Отпечаток", max_length=40, unique=True)
+    sql = models.TextField("Нормализованный запрос")
+    example = models.TextField("Пример запроса")
+    params = models.JSONField("Параметры", null=True, encoder=DjangoJSONEncoder)
+    view = models.CharField("Страница или команда", max_length=255, blank=True)
+    caller = models.CharField("Место вызова", max_length=255, blank=True)
+    stack = models.TextField("Стек вызовов", blank=True)
+    calls = models.BigIntegerField("Выполнений", default=0)
+    total_duration = models.FloatField("Общее время, мс", default=0)
+    max_duration = models.FloatField("Максимальное время, мс", default=0)
+    rows = models.BigIntegerField("Строк", null=True)
+    first_seen = models.DateTimeField("Первое выполнение", default=timezone.now)
+    last_seen = models.DateTimeField("Последнее выполнение", default=timezone.now)
+
+    def __str__(self):
+        return f"{self.sql[:80]} ({self.calls})"
+
+    class Meta:
+        db_table = "SlowQueries"
+        verbose_name = "Медленный запрос"
+        verbose_name_plural = "Медленные запросы"
+        indexes = [Index(fields=["last_seen"], name="slow_queries_last_seen_idx")]
@@ -0,0 +1,250 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+
+from .metrics import collect, inc
+from .registry import DATA_TABLES
+from .versions import table_versions
+
+# Ключ версии каталога процедур в TableVersions
+CATALOG = "pg_proc"
+# Режимы аргументов в pg_proc.proargmodes; аргументы 't' - столбцы
+# результата RETURNS TABLE и в список аргументов не входят
+ARG_MODES = {"i": "IN", "o": "OUT", "b": "INOUT", "v": "VARIADIC"}
+# Процедуры с такими операторами или функциями изменяют данные или зависят
+# от текущего времени, их результат не кэшируется
+NOT_CACHEABLE = re.compile(
+    r"\b(insert|update|delete|truncate|now|current_time|current_timestamp|localtime|"
+    r"localtimestamp|clock_timestamp|statement_timestamp|transaction_timestamp|random)\b",
+    re.IGNORECASE,
+)
+# Результат зависит от текущей даты: в ключ кэша добавляется дата
+USES_DATE = re.compile(r"\bcurrent_date\b", re.IGNORECASE)
+# Результаты с большим числом строк в кэш не попадают
+CACHE_MAX_ROWS = 100000
+CACHE_STATS = ("hits", "misses", "skipped")
+CACHE_METRIC = "info21_result_cache_total"
+
+CATALOG_SQL = """
+    SELECT
+    p.prokind,
+    p.proname,
+    pg_get_function_identity_arguments(p.oid),
+    pg_get_function_result(p.oid),
+    COALESCE(p.proargnames, '{}'),
+    COALESCE(p.proargmodes::text[], '{}'),
+    ARRAY(
+        SELECT format_type(t.oid, NULL)
+        FROM unnest(COALESCE(p.proallargtypes, p.proargtypes::oid[]))
+        WITH ORDINALITY AS t(oid, i)
+        ORDER BY t.i
+    ),
+    ARRAY(
+        SELECT pg_get_function_arg_default(p.oid, i)
+        FROM generate_series(1, COALESCE(array_length(p.proallargtypes, 1), p.pronargs)) AS i
+    ),
+    p.prosrc
+    FROM
+    pg_proc p
+    JOIN pg_namespace n ON p.pronamespace = n.oid
+    WHERE
+    n.nspname = 'public'
+    AND p.prokind IN ('f', 'p')
+    AND p.prorettype <> 'trigger'::regtype
+    ORDER BY p.oid
+"""
+
+
+class ProcArg(NamedTuple):
+    """Аргумент процедуры или функции."""
+
+    name: str
+    mode: str
+    type: str
+    default: str = None
+
+    @property
+    def is_refcursor(self):
+        return self.type == "refcursor"
+
+
+class Procedure(NamedTuple):
+    """Процедура или функция из каталога БД."""
+
+    type: str
+    name: str
+    args: tuple
+    parameters: str
+    return_type: str
+    description: str
+    # Таблицы, из которых читает процедура, в том числе через вызываемые ею
+    # процедуры и функции
+    tables: frozenset = frozenset()
+    cacheable: bool = False
+    uses_date: bool = False
+    # Материализованные представления, которые нужно обновить перед вызовом
+    matviews: frozenset = frozenset()
+
+    # Аргументы, значения которых вводит пользователь: курсор для результата
+    # процедуры передается при вызове
+    @property
+    def input_args(self):
+        return [arg for arg in self.args if arg.mode != "OUT" and not arg.is_refcursor]
+
+
+_cache = {"key": None, "procedures": {}}
+_lock = threading.Lock()
+
+
+def funcs_path():
+    return os.path.abspath(__file__).replace(
+        os.path.basename(__file__), "../data/funcs.csv"
+    )
+
+
+def read_descriptions():
+    funcs = {}
+    with open(funcs_path(), "r", encoding="utf8") as f:
+        for i in csv.reader(f, delimiter="|"):
+            funcs[i[0].lower()] = i[1]
+    return funcs
+
+
+def load_procedures():
+    with connection.cursor() as cursor:
+        cursor.execute(CATALOG_SQL)
+        rows = cursor.fetchall()
+        cursor.execute(
+            "SELECT matviewname, definition FROM pg_matviews WHERE schemaname = 'public'"
+        )
+        matviews = dict(cursor.fetchall())
+    descriptions = read_descriptions()
+    procedures, sources = {}, dict(matviews)
+    for kind, name, parameters, result, names, modes, types, defaults, source in rows:
+        args = tuple(
+            ProcArg(
+                names[i] if i < len(names) else f"${i + 1}",
+                ARG_MODES[modes[i] if modes else "i"],
+                types[i],
+                defaults[i],
+            )
+            for i in range(len(types))
+            if not modes or modes[i] != "t"
+        )
+        if name in procedures:
+            continue
+        procedures[name] = Procedure(
+            "PROCEDURE" if kind == "p" else "FUNCTION",
+            name,
+            args,
+            parameters,
+            result,
+            descriptions.get(name),
+        )
+        sources[name] = source or ""
+    return {
+        name: procedure._replace(**analyze_source(name, sources, matviews))
+        for name, procedure in procedures.items()
+    }
+
+
+def mentions(source: str, name: str):
+    return re.search(rf"\b{re.escape(name)}\b", source, re.IGNORECASE) is not None
+
+
+# Таблицы и свойства процедуры по ее исходному тексту с учетом вызываемых
+# процедур, функций и материализованных представлений. Лишняя таблица
+# только уменьшает число попаданий в кэш
+def analyze_source(name: str, sources: dict, matviews=()):
+    seen, pending = set(), [name]
+    while pending:
+        current = pending.pop()
+        seen.add(current)
+        pending += [
+            other for other in sources
+            if other not in seen and other != current and mentions(sources[current], other)
+        ]
+    text = "\n".join(sources[current] for current in seen)
+    return {
+        "tables": frozenset(table for table in DATA_TABLES if mentions(text, table)),
+        "cacheable": NOT_CACHEABLE.search(text) is None,
+        "uses_date": USES_DATE.search(text) is not None,
+        "matviews": frozenset(seen & set(matviews)),
+    }
+
+
+# Каталог процедур, построенный один раз на процесс. Перестраивается, если
+# изменилась версия каталога в БД (ее увеличивает import_operations и
+# выполнение DDL через произвольный SQL-запрос) или файл описаний
+def get_procedures():
+    versions = table_versions([CATALOG])
+    key = (versions.get(CATALOG), os.stat(funcs_path()).st_mtime)
+    if _cache["key"] != key:
+        with _lock:
+            if _cache["key"] != key:
+                _cache["procedures"] = load_procedures()
+                _cache["key"] = key
+    return _cache["procedures"]
+
+
+def get_procedure(name: str):
+    try:
+        return get_procedures()[name]
+    except KeyError:
+        raise LookupError(f"Процедура или функция {name} не найдена.")
+
+
+# Счетчики кэша результатов ведутся в памяти процесса и сохраняются вместе
+# с остальными метриками: incr файлового кэша не атомарен между процессами
+def count(stat: str):
+    inc(CACHE_METRIC, (stat,))
+
+
+# Счетчики кэша результатов, сумма по всем процессам
+def cache_stats():
+    values = collect()
+    return {stat: values.get((CACHE_METRIC, (stat,)), [0])[0] for stat in CACHE_STATS}
+
+
+# Ключ результата: имя, параметры и версии таблиц, из которых читает
+# процедура, а для зависящих от даты процедур - текущая дата БД
+def result_key(procedure: Procedure, params: list):
+    versions = table_versions(procedure.tables)
+    parts = [
+        procedure.name,
+        [str(param).strip() for param in params],
+        sorted((table, version) for table, (version, _) in versions.items()),
+    ]
+    if procedure.uses_date:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_date")
+            parts.append(cursor.fetchone()[0])
+    digest = hashlib.sha256(json.dumps(parts, cls=DjangoJSONEncoder).encode())
+    return f"result:{procedure.name}:{digest.hexdigest()}"
+
+
+# Вызов процедуры через кэш результатов: call(name, params) выполняет
+# процедуру, если результата для текущих версий таблиц еще нет
+def call_cached(procedure: Procedure, params: list, call):
+    if not procedure.cacheable:
+        count("skipped")
+        return (*call(procedure.name, list(params)), False)
+    cache = caches["procedures"]
+    key = result_key(procedure, params)
+    result = cache.get(key)
+    if result is not None:
+        count("hits")
+        return (*result, True)
+    count("misses")
+    columns, rows = call(procedure.name, list(params))
+    if len(rows) <= CACHE_MAX_ROWS:
+        cache.set(key, (columns, rows))
+    return columns, rows, False
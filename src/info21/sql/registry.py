@@ -0,0 +1,89 @@
+from typing import NamedTuple
+
+from django.apps import apps
+from django.forms import modelform_factory
+
+# Таблицы с данными в порядке отображения на странице "Данные"
+DATA_TABLES = [
+    "P2P",
+    "XP",
+    "Checks",
+    "Friends",
+    "Peers",
+    "Recommendations",
+    "Tasks",
+    "TimeTracking",
+    "TransferredPoints",
+    "Verter",
+]
+
+# Типы полей, по которым доступны фильтры по диапазону и по началу строки
+RANGE_TYPES = ("DateField", "TimeField", "IntegerField", "BigIntegerField", "BigAutoField")
+PREFIX_TYPES = ("CharField", "TextField")
+
+
+class TableMeta(NamedTuple):
+    """Метаданные таблицы, вычисляемые один раз при запуске приложения."""
+
+    model: type
+    verbose_names: list
+    pk: object
+    form: type
+    # Параметр запроса -> (поле, lookup) для фильтров страницы таблицы
+    filters: dict
+    # Поля для фильтров в форме: (параметр, подпись)
+    filter_inputs: list
+
+
+TABLES = {}
+
+
+# Допустимые фильтры поля: равенство, диапазон для дат, времени и чисел,
+# начало строки для текстовых полей (в том числе ссылок на Peers и Tasks)
+def field_filters(field):
+    target = field.target_field if field.is_relation else field
+    lookups = ["exact"]
+    if target.get_internal_type() in RANGE_TYPES and not field.is_relation:
+        lookups += ["gte", "lte"]
+    if target.get_internal_type() in PREFIX_TYPES and not field.choices:
+        lookups += ["startswith"]
+    return {
+        (field.name if lookup == "exact" else f"{field.name}__{lookup}"): (field, lookup)
+        for lookup in lookups
+    }
+
+
+# Поля формы фильтра: для полей с диапазоном или префиксом равенство
+# доступно только через параметры запроса
+def field_inputs(filters):
+    labels = {"exact": "", "gte": " от", "lte": " до", "startswith": " начинается с"}
+    return [
+        (param, f"{field.verbose_name}{labels[lookup]}")
+        for param, (field, lookup) in filters.items()
+        if lookup != "exact" or len(filters) == 1
+    ]
+
+
+def build_registry():
+    for table_name in DATA_TABLES:
+        model = apps.get_model(app_label="sql", model_name=table_name)
+        filters, inputs = {}, []
+        for field in model._meta.fields:
+            filters.update(field_filters(field))
+            inputs += field_inputs(field_filters(field))
+        TABLES[table_name] = TableMeta(
+            model=model,
+            verbose_names=[field.verbose_name for field in model._meta.fields],
+            pk=model._meta.pk,
+            form=modelform_factory(model, exclude=[]),
+            filters=filters,
+            filter_inputs=inputs,
+        )
+
+
+# Метаданные таблицы по имени; LookupError, как и у apps.get_model
+def get_table(table_name: str):
+    try:
+        return TABLES[table_name]
+    except KeyError:
+        raise LookupError(f"Таблица {table_name} не найдена.")
@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Результат хранится в двух файлах: <hash>.dat - сжатые блоки по BLOCK_ROWS
+# строк, <hash>.idx - столбцы, число строк и смещения блоков. Одинаковые
+# результаты получают одинаковый хэш и хранятся один раз
+HANDLE = re.compile(r"^[0-9a-f]{64}$")
+DEFAULTS = {
+    "TIMEOUT": 24 * 60 * 60,
+    "MAX_RESULT_BYTES": 32 * 1024 * 1024,
+    "MAX_BYTES": 512 * 1024 * 1024,
+    "BLOCK_ROWS": 1000,
+}
+PURGED = "Результат устарел и был удален, выполните запрос еще раз."
+
+
+def store_settings():
+    return {**DEFAULTS, **settings.RESULT_STORE}
+
+
+def result_path(handle: str, ext: str):
+    if not HANDLE.match(handle):
+        raise LookupError(f"Неверный идентификатор результата: {handle}")
+    return os.path.join(store_settings()["LOCATION"], f"{handle}.{ext}")
+
+
+# Сохранение результата: возвращает описание, которое хранится в задаче
+# вместо строк. Сжатые данные больше MAX_RESULT_BYTES обрезаются по блокам
+def save_result(columns: list, rows: list):
+    options = store_settings()
+    os.makedirs(options["LOCATION"], exist_ok=True)
+    digest = hashlib.sha256(json.dumps(columns).encode())
+    block_rows = options["BLOCK_ROWS"]
+    offsets, stored, truncated = [0], 0, False
+    with tempfile.NamedTemporaryFile(dir=options["LOCATION"], delete=False) as f:
+        for start in range(0, len(rows), block_rows):
+            block = json.dumps(rows[start:start + block_rows], cls=DjangoJSONEncoder).encode()
+            data = zlib.compress(block)
+            if offsets[-1] + len(data) > options["MAX_RESULT_BYTES"]:
+                truncated = True
+                break
+            digest.update(block)
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            stored += min(block_rows, len(rows) - start)
+    digest.update(f"{stored}:{block_rows}".encode())
+    handle = digest.hexdigest()
+    index = {
+        "columns": columns,
+        "rows": stored,
+        "block_rows": block_rows,
+        "offsets": offsets,
+        "truncated": truncated,
+    }
+    if os.path.exists(result_path(handle, "idx")):
+        os.remove(f.name)
+        os.utime(result_path(handle, "idx"))
+    else:
+        os.replace(f.name, result_path(handle, "dat"))
+        with tempfile.NamedTemporaryFile("w", dir=options["LOCATION"], delete=False) as idx:
+            json.dump(index, idx)
+        os.replace(idx.name, result_path(handle, "idx"))
+    return {"handle": handle, "columns": columns, "rows": stored, "truncated": truncated}
+
+
+def open_data(handle: str):
+    try:
+        return open(result_path(handle, "dat"), "rb")
+    except FileNotFoundError:
+        raise LookupError(PURGED)
+
+
+def read_index(handle: str):
+    try:
+        with open(result_path(handle, "idx"), encoding="utf8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        raise LookupError(PURGED)
+    # Время обращения обновляется не при каждом чтении страницы
+    path = result_path(handle, "idx")
+    if time.time() - os.stat(path).st_mtime > store_settings()["TIMEOUT"] / 2:
+        os.utime(path)
+    return index
+
+
+# Чтение строк [offset, offset + limit): распаковываются только нужные блоки
+def read_result(handle: str, offset: int = 0, limit: int = None):
+    index = read_index(handle)
+    stop = index["rows"] if limit is None else min(index["rows"], offset + limit)
+    if offset >= stop:
+        return []
+    block_rows, offsets = index["block_rows"], index["offsets"]
+    first, last = offset // block_rows, (stop - 1) // block_rows
+    with open_data(handle) as f:
+        f.seek(offsets[first])
+        data = f.read(offsets[last + 1] - offsets[first])
+    rows = []
+    for block in range(first, last + 1):
+        start, end = offsets[block] - offsets[first], offsets[block + 1] - offsets[first]
+        rows += json.loads(zlib.decompress(data[start:end]))
+    skip = offset - first * block_rows
+    return rows[skip:skip + stop - offset]
+
+
+# Все строки результата по блокам. Индекс и файл данных открываются при
+# вызове: LookupError возникает до начала ответа, а открытый файл дочитывается,
+# даже если очистка удалит результат во время отдачи
+def iter_result(handle: str):
+    index = read_index(handle)
+    return iter_blocks(index["offsets"], open_data(handle))
+
+
+def iter_blocks(offsets: list, f):
+    with f:
+        for start, end in zip(offsets, offsets[1:]):
+            f.seek(start)
+            yield json.loads(zlib.decompress(f.read(end - start)))
+
+
+class StoredRows:
+    """Строки сохраненного результата для Paginator: читается только
+    запрошенный срез."""
+
+    def __init__(self, handle: str, count: int):
+        self.handle = handle
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop, _ = key.indices(self.count)
+        return read_result(self.handle, start, stop - start)
+
+
+# Удаление результатов, к которым не обращались дольше TIMEOUT, и самых
+# старых, пока общий размер больше MAX_BYTES. Запускается обработчиком задач
+def purge_results():
+    options = store_settings()
+    now, results, deleted = time.time(), [], 0
+    for idx in glob.glob(os.path.join(options["LOCATION"], "*.idx")):
+        dat = idx[:-4] + ".dat"
+        try:
+            mtime = os.stat(idx).st_mtime
+            size = os.stat(idx).st_size + os.stat(dat).st_size
+        except FileNotFoundError:
+            continue
+        results.append((mtime, size, idx, dat))
+    # Файлы, оставшиеся после прерванной записи
+    for tmp in glob.glob(os.path.join(options["LOCATION"], "tmp*")):
+        try:
+            if now - os.stat(tmp).st_mtime > options["TIMEOUT"]:
+                os.remove(tmp)
+        except FileNotFoundError:
+            pass
+    total = sum(size for _, size, _, _ in results)
+    for mtime, size, idx, dat in sorted(results):
+        if now - mtime <= options["TIMEOUT"] and total <= options["MAX_BYTES"]:
+            break
+        for fname in (idx, dat):
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+        total -= size
+        deleted += 1
+    return deleted
@@ -0,0 +1,26 @@
+from rest_framework import serializers
+
+
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    """Сериализатор, оставляющий только поля из параметра запроса ?fields=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or not request.query_params.get("fields"):
+            return
+        fields = set(request.query_params["fields"].split(","))
+        fields.add(self.Meta.model._meta.pk.name)
+        for name in set(self.fields) - fields:
+            self.fields.pop(name)
+
+
+# Сериализатор таблицы: классы строятся для каждой модели из
+# registry.DATA_TABLES, а не описываются вручную
+def model_serializer(model):
+    meta = type("Meta", (), {"model": model, "fields": "__all__"})
+    return type(
+        f"{model.__name__}Serializer",
+        (SparseFieldsSerializer,),
+        {"Meta": meta, "__module__": __name__},
+    )
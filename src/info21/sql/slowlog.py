@@ -0,0 +1,219 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import current_timing
+from .models import SlowQuery
+
+# Нормализация запроса: литералы и параметры заменяются на ?, списки
+# значений сворачиваются, чтобы запросы с разными данными совпадали
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"(?<![\w\"])-?\d+(?:\.\d+)?(?![\w\"])")
+PARAM = re.compile(r"%s|%\(\w+\)s")
+IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+VALUES_LIST = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+SPACES = re.compile(r"\s+")
+# Параметры сохраняются в сокращенном виде
+MAX_PARAMS = 20
+MAX_PARAM_LENGTH = 200
+# Кадры стека этих файлов не относятся к месту вызова
+SKIP_FILES = ("manage.py", "sql/logger.py", "sql/metrics.py", "sql/slowlog.py")
+
+_local = threading.local()
+_lock = threading.Lock()
+_pending = {}
+
+
+def normalize(sql: str):
+    sql = STRING.sub("?", sql)
+    sql = PARAM.sub("?", sql)
+    sql = NUMBER.sub("?", sql)
+    sql = IN_LIST.sub("IN (...)", sql)
+    sql = VALUES_LIST.sub(r"\1, ...", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def fingerprint(sql: str):
+    return hashlib.sha1(sql.encode()).hexdigest()
+
+
+def short_param(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, memoryview)):
+        return f"<{len(value)} байт>"
+    value = str(value)
+    return value if len(value) <= MAX_PARAM_LENGTH else value[:MAX_PARAM_LENGTH] + "..."
+
+
+# Параметры запроса, для executemany - первого набора
+def short_params(params, many: bool):
+    if many:
+        params = next(iter(params), None)
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: short_param(value) for key, value in list(params.items())[:MAX_PARAMS]}
+    return [short_param(value) for value in list(params)[:MAX_PARAMS]]
+
+
+# Кадры приложения от внутреннего к внешнему: "sql/utils.py:390 iter_query"
+def app_stack():
+    base = str(settings.BASE_DIR) + os.sep
+    frames = []
+    for frame in reversed(traceback.extract_stack()):
+        if not frame.filename.startswith(base):
+            continue
+        path = os.path.relpath(frame.filename, base)
+        if path.endswith(SKIP_FILES):
+            continue
+        frames.append(f"{path}:{frame.lineno} {frame.name}")
+    return frames[:settings.SQL_SLOW_STACK]
+
+
+# Страница (имя URL) для запроса пользователя, иначе команда manage.py
+def current_view():
+    timing = current_timing.get()
+    request = getattr(timing, "request", None)
+    if request is not None:
+        match = request.resolver_match
+        return match.view_name if match else request.path
+    return " ".join(os.path.basename(arg) for arg in sys.argv[:2])
+
+
+def record(sql, params, many, duration, rows):
+    normalized = normalize(sql)
+    key = fingerprint(normalized)
+    stack = app_stack()
+    with _lock:
+        entry = _pending.setdefault(
+            key, {"sql": normalized, "calls": 0, "total": 0.0, "max": 0.0, "first": timezone.now()}
+        )
+        entry["calls"] += 1
+        entry["total"] += duration
+        entry["max"] = max(entry["max"], duration)
+        entry.update(
+            example=sql,
+            params=short_params(params, many),
+            view=current_view()[:255],
+            caller=stack[0][:255] if stack else "",
+            stack="\n".join(stack),
+            rows=rows,
+            last=timezone.now(),
+        )
+
+
+class SlowQueryRecorder:
+    """Обертка выполнения запросов (execute_wrapper): запросы дольше
+    SQL_SLOW_QUERY_MS накапливаются в памяти процесса и сохраняются
+    функцией flush вне транзакций."""
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_local, "paused", False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            if duration >= settings.SQL_SLOW_QUERY_MS:
+                rowcount = getattr(context["cursor"], "rowcount", -1)
+                record(sql, params, many, duration, rowcount if rowcount >= 0 else None)
+
+
+recorder = SlowQueryRecorder()
+
+
+# Подключение к каждому новому соединению с БД
+def install_recorder(sender, connection, **kwargs):
+    if settings.SQL_SLOW_QUERIES and recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(recorder)
+
+
+UPSERT = """
+    INSERT INTO "SlowQueries" (
+        fingerprint, sql, example, params, view, caller, stack,
+        calls, total_duration, max_duration, rows, first_seen, last_seen
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (fingerprint) DO UPDATE SET
+        example = EXCLUDED.example,
+        params = EXCLUDED.params,
+        view = EXCLUDED.view,
+        caller = EXCLUDED.caller,
+        stack = EXCLUDED.stack,
+        calls = "SlowQueries".calls + EXCLUDED.calls,
+        total_duration = "SlowQueries".total_duration + EXCLUDED.total_duration,
+        max_duration = GREATEST("SlowQueries".max_duration, EXCLUDED.max_duration),
+        rows = EXCLUDED.rows,
+        last_seen = EXCLUDED.last_seen
+"""
+
+
+# Сохранение накопленных запросов с суммированием по отпечатку. Внутри
+# транзакции не выполняется: ее откат потерял бы записи
+def flush():
+    if not _pending or connection.in_atomic_block:
+        return
+    with _lock:
+        entries = list(_pending.items())
+        _pending.clear()
+    rows = [
+        (
+            key, entry["sql"], entry["example"],
+            None if entry["params"] is None else json.dumps(entry["params"]), entry["view"],
+            entry["caller"], entry["stack"], entry["calls"], entry["total"], entry["max"],
+            entry["rows"], entry["first"], entry["last"],
+        )
+        for key, entry in entries
+    ]
+    _local.paused = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.executemany(UPSERT, rows)
+    except DatabaseError:
+        pass
+    finally:
+        _local.paused = False
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+# Порядок вывода медленных запросов по имени столбца
+SLOW_ORDER = {
+    "total": "-total_duration",
+    "max": "-max_duration",
+    "calls": "-calls",
+    "last": "-last_seen",
+}
+
+
+def slow_queries(order: str = "total", limit: int = 100):
+    queries = SlowQuery.objects.annotate(avg_duration=F("total_duration") / F("calls"))
+    return queries.order_by(SLOW_ORDER.get(order, "-total_duration"))[:limit]
+
+
+def prune_slow_queries():
+    since = timezone.now() - timedelta(days=settings.SQL_STATS_DAYS)
+    deleted, _ = SlowQuery.objects.filter(last_seen__lt=since).delete()
+    return deleted
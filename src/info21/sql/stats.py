@@ -0,0 +1,229 @@
+import json
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import checks
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Aggregate, Avg, Count, F, FloatField, Max, Q
+from django.utils import timezone
+
+from .metrics import observe
+from .models import Execution
+
+# Параметры auto_explain на время профилируемого выполнения: планы
+# запросов, в том числе выполняемых внутри процедур, с фактическим
+# временем и буферами приходят клиенту как NOTICE
+AUTO_EXPLAIN = {
+    "auto_explain.log_analyze": "on",
+    "auto_explain.log_buffers": "on",
+    "auto_explain.log_timing": "on",
+    "auto_explain.log_nested_statements": "on",
+    "auto_explain.log_format": "json",
+    "auto_explain.log_level": "notice",
+}
+EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+# Сообщение auto_explain: "duration: 1.234 ms  plan:\n{...}"
+PLAN_NOTICE = "plan:\n"
+
+
+class Percentile(Aggregate):
+    """Процентиль распределения, percentile_cont в PostgreSQL."""
+
+    function = "percentile_cont"
+    name = "Percentile"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile: float, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+# Проверка auto_explain для нового соединения. Модуль должен быть загружен
+# сервером (session_preload_libraries) или суперпользователем, а его
+# параметры - разрешены роли через GRANT SET ON PARAMETER (db/auto_explain.sql).
+# Параметры остаются по умолчанию, то есть auto_explain выключен; иначе
+# планы снимаются явным EXPLAIN
+def setup_auto_explain(sender, connection, **kwargs):
+    connection.auto_explain = False
+    if connection.vendor != "postgresql" or not settings.SQL_AUTO_EXPLAIN:
+        return
+    connection.auto_explain = auto_explain_available(connection)
+
+
+def auto_explain_available(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_settings WHERE name = 'auto_explain.log_format'")
+            if cursor.fetchone() is None:
+                cursor.execute("LOAD 'auto_explain'")
+            # SET требует тех же прав, что и SET LOCAL в explain_locally
+            for name in (*AUTO_EXPLAIN, "auto_explain.log_min_duration"):
+                cursor.execute(f"SET {name} = DEFAULT")
+    except DatabaseError:
+        return False
+    return True
+
+
+# Проверка manage.py check --database default (выполняется и при migrate):
+# без auto_explain планы процедур не сохраняются
+def check_auto_explain(app_configs=None, databases=None, **kwargs):
+    if not settings.SQL_AUTO_EXPLAIN or "default" not in (databases or ()):
+        return []
+    connection.ensure_connection()
+    if connection.vendor != "postgresql" or connection.auto_explain:
+        return []
+    return [
+        checks.Warning(
+            "auto_explain недоступен, планы процедур снимаются только явным EXPLAIN "
+            "и не сохраняются для CALL.",
+            hint="Выполните db/auto_explain.sql от имени суперпользователя и переподключитесь "
+            "или отключите SQL_AUTO_EXPLAIN.",
+            id="sql.W001",
+        )
+    ]
+
+
+# Включение auto_explain до конца текущей транзакции (SET LOCAL), если она
+# выполняется внутри profile: замер времени узлов плана не замедляет
+# остальные запросы приложения. Вызывается внутри transaction.atomic()
+def explain_locally():
+    explain = getattr(connection, "profiling", None)
+    if explain is None or not connection.in_atomic_block or not getattr(connection, "auto_explain", False):
+        return
+    min_duration = 0 if explain else int(settings.SQL_EXPLAIN_MIN_MS)
+    statements = [f"SET LOCAL {name} = {value}" for name, value in AUTO_EXPLAIN.items()]
+    statements.append(f"SET LOCAL auto_explain.log_min_duration = {min_duration}")
+    with connection.cursor() as cursor:
+        cursor.execute("; ".join(statements))
+
+
+def parse_plan(notice: str):
+    _, found, plan = notice.partition(PLAN_NOTICE)
+    if not found:
+        return None
+    try:
+        return json.loads(plan)
+    except ValueError:
+        return None
+
+
+# План запроса явным EXPLAIN ANALYZE. Запрос выполняется еще раз, поэтому
+# только в транзакции для чтения, которая затем откатывается: запрос,
+# изменяющий данные, завершится ошибкой и останется без плана
+def explain_plan(sql: str, params=None):
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION READ ONLY")
+            cursor.execute(EXPLAIN + sql, params)
+            plan = cursor.fetchone()[0]
+            transaction.set_rollback(True)
+    except DatabaseError:
+        return []
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+# Буферы выполнения по корневым узлам планов. Вызов процедуры сам в план не
+# попадает, поэтому суммируются планы всех ее запросов; в остальных случаях
+# внешний запрос завершается последним и уже включает вложенные
+def plan_buffers(plans: list, kind: str):
+    roots = [plan["Plan"] for plan in plans if "Plan" in plan]
+    if kind != "PROCEDURE":
+        roots = roots[-1:]
+    if not roots:
+        return None, None
+    return (
+        sum(root.get("Shared Hit Blocks", 0) for root in roots),
+        sum(root.get("Shared Read Blocks", 0) for root in roots),
+    )
+
+
+# Время выполнения внутри блока прибавляется к execution.duration
+@contextmanager
+def timed(execution: Execution):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        execution.duration += (time.perf_counter() - start) * 1000
+
+
+# Замер выполнения кода внутри блока; количество строк результата код
+# записывает в execution.rows. План сохраняется по запросу (explain) или
+# если выполнение дольше SQL_EXPLAIN_MIN_MS: из auto_explain, который код
+# включает в своей транзакции через explain_locally, а если он недоступен -
+# явным EXPLAIN запроса explain_sql. Для результата, который читается по
+# мере отправки клиенту (streamed), время складывается только из блоков
+# timed вокруг обращений к БД
+@contextmanager
+def profile(
+    routine: str, kind: str, query: str = "", params=(), explain=False, explain_sql=None, streamed=False
+):
+    execution = Execution(routine=routine, kind=kind, query=query, params=list(params), duration=0)
+    if not settings.SQL_STATS:
+        yield execution
+        return
+    connection.ensure_connection()
+    auto = getattr(connection, "auto_explain", False)
+    notices = connection.connection.notices
+    del notices[:]
+    profiling = getattr(connection, "profiling", None)
+    connection.profiling = explain
+    start = time.perf_counter()
+    try:
+        yield execution
+    except Exception as err:
+        execution.error = str(err)
+        raise
+    finally:
+        if not streamed:
+            execution.duration = (time.perf_counter() - start) * 1000
+        connection.profiling = profiling
+        observe("info21_routine_duration_seconds", (routine, kind), execution.duration / 1000)
+        plans = [plan for plan in map(parse_plan, notices) if plan] if auto else []
+        slow = execution.duration >= settings.SQL_EXPLAIN_MIN_MS
+        if not plans and explain_sql and not execution.error and (explain or slow):
+            plans = explain_plan(explain_sql, list(params) or None)
+        execution.plan = plans or None
+        execution.shared_hit, execution.shared_read = plan_buffers(plans, kind)
+        try:
+            execution.save()
+        except DatabaseError:
+            pass
+
+
+# Сводка по процедурам за последние SQL_STATS_DAYS дней: перцентили
+# времени успешных выполнений и последний сохраненный план
+def routine_stats():
+    since = timezone.now() - timedelta(days=settings.SQL_STATS_DAYS)
+    executions = Execution.objects.filter(created__gte=since)
+    ok = Q(error="")
+    stats = list(
+        executions.values("routine", "kind")
+        .annotate(
+            calls=Count("id"),
+            errors=Count("id", filter=~ok),
+            p50=Percentile("duration", 0.5, filter=ok),
+            p95=Percentile("duration", 0.95, filter=ok),
+            max_duration=Max("duration", filter=ok),
+            avg_rows=Avg("rows", filter=ok),
+            last=Max("created"),
+        )
+        .order_by(F("p95").desc(nulls_last=True), "routine")
+    )
+    plans = {
+        execution.routine: execution
+        for execution in executions.filter(plan__isnull=False)
+        .order_by("routine", "-created")
+        .distinct("routine")
+    }
+    for row in stats:
+        row["plan"] = plans.get(row["routine"])
+    return stats
+
+
+def prune_executions():
+    since = timezone.now() - timedelta(days=settings.SQL_STATS_DAYS)
+    deleted, _ = Execution.objects.filter(created__lt=since).delete()
+    return deleted
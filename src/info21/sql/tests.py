@@ -0,0 +1,380 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import jobs
+from .import_obj import DeltaLoader, load_csv, read_chunks
+from .models import Checks, Job, JobStatus, Peers, Tasks
+from .procedures import CATALOG
+from .registry import get_table
+from .results import iter_result, read_result, result_path, save_result
+from .slowlog import normalize
+from .utils import get_page, is_select, parse_filters
+from .versions import bump_version
+
+
+# Хранилище результатов тестов - во временном каталоге
+class TempStoreMixin:
+    def setUp(self):
+        super().setUp()
+        self.store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store, True)
+        patcher = override_settings(RESULT_STORE={"LOCATION": self.store})
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+
+class CopyImportTests(TestCase):
+    """Загрузка CSV через COPY во временную таблицу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Peers.objects.create(nickname="alice")
+        Tasks.objects.create(title="C1")
+
+    def test_load_in_batches(self):
+        data = "Nickname,Birthday\n" + "".join(f"p{i},2000-01-01\n" for i in range(25))
+        stats = load_csv(Peers, io.BytesIO(data.encode()), batch_size=10)
+        self.assertEqual((stats.rows, stats.inserted), (25, 25))
+        self.assertEqual(Peers.objects.count(), 26)
+
+    def test_existing_rows_are_skipped(self):
+        stats = load_csv(Peers, io.BytesIO(b"Nickname,Birthday\nalice,\nbob,\n"))
+        self.assertEqual((stats.rows, stats.inserted), (2, 1))
+
+    def test_gzip_source(self):
+        data = gzip.compress(b"\xef\xbb\xbfNickname,Birthday\r\nbob,1999-12-31\r\n")
+        self.assertEqual("".join(read_chunks(io.BytesIO(data))).split("\r\n")[1], "bob,1999-12-31")
+        load_csv(Peers, io.BytesIO(data))
+        self.assertEqual(Peers.objects.get(pk="bob").birthday, date(1999, 12, 31))
+
+    def test_wrong_header(self):
+        with self.assertRaises(ValueError):
+            load_csv(Peers, io.BytesIO(b"Name,Birthday\nbob,\n"))
+
+    def test_missing_reference_is_reported(self):
+        data = b"ID,Peer,Task,Date\n1,alice,C1,2023-01-01\n2,nobody,C1,2023-01-02\n"
+        with self.assertRaisesMessage(ValueError, "nobody"):
+            load_csv(Checks, io.BytesIO(data))
+        self.assertFalse(Checks.objects.exists())
+
+
+class UploadCsrfTests(TestCase):
+    """Токен CSRF проверяется до загрузки файла."""
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.url = reverse("sql:data_import", kwargs={"table": "Peers"})
+
+    def upload(self, **extra):
+        file = io.BytesIO(b"Nickname,Birthday\nalice,\n")
+        file.name = "Peers.csv"
+        return self.client.post(self.url, {"file": file}, **extra)
+
+    def test_rejected_without_token(self):
+        self.assertEqual(self.upload().status_code, 403)
+        self.assertFalse(Peers.objects.exists())
+
+    def test_accepted_with_token(self):
+        token = "a" * 32
+        self.client.cookies["csrftoken"] = token
+        self.assertEqual(self.upload(HTTP_X_CSRFTOKEN=token).status_code, 302)
+        self.assertTrue(Peers.objects.filter(pk="alice").exists())
+
+
+class DeltaImportTests(TestCase):
+    """Синхронизация таблицы с файлом: добавление, изменение и удаление."""
+
+    def test_sync(self):
+        Peers.objects.create(nickname="alice", birthday=date(1990, 1, 1))
+        Peers.objects.create(nickname="bob", birthday=date(1991, 1, 1))
+        Peers.objects.create(nickname="carol", birthday=date(1992, 1, 1))
+        loader = DeltaLoader(Peers)
+        loader.feed("Nickname,Birthday\nalice,1990-01-01\nbob,2001-01-01\n")
+        loader.feed("dave,2002-01-01")
+        loader.end_input()
+        loader.upsert()
+        loader.delete_missing()
+        loader.close()
+        stats = loader.stats()
+        self.assertEqual((stats.inserted, stats.updated, stats.deleted), (1, 1, 1))
+        self.assertEqual(
+            dict(Peers.objects.values_list("nickname", "birthday")),
+            {
+                "alice": date(1990, 1, 1),
+                "bob": date(2001, 1, 1),
+                "dave": date(2002, 1, 1),
+            },
+        )
+
+    def test_referenced_rows_are_kept(self):
+        Peers.objects.create(nickname="alice")
+        Peers.objects.create(nickname="bob")
+        Tasks.objects.create(title="C1")
+        Checks.objects.create(peer_id="bob", task_id="C1")
+        loader = DeltaLoader(Peers)
+        loader.feed("Nickname,Birthday\ncarol,\n")
+        loader.end_input()
+        loader.upsert()
+        loader.delete_missing()
+        loader.close()
+        stats = loader.stats()
+        self.assertEqual((stats.deleted, stats.kept), (1, 1))
+        self.assertEqual(set(Peers.objects.values_list("pk", flat=True)), {"bob", "carol"})
+
+    def test_empty_file(self):
+        loader = DeltaLoader(Peers)
+        loader.end_input()
+        with self.assertRaises(ValueError):
+            loader.upsert()
+
+
+class JobQueueTests(TestCase):
+    """Очередь фоновых задач: захват, выполнение и брошенные задачи."""
+
+    def run_next(self, handler):
+        with mock.patch.dict(jobs.JOB_HANDLERS, {"import": handler}):
+            job = jobs.claim_next()
+            return jobs.run_job(job)
+
+    def test_claim_in_order(self):
+        first = jobs.submit("import", table="Peers")
+        jobs.submit("import", table="Tasks")
+        job = jobs.claim_next()
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual(job.status, JobStatus.RUNNING)
+        self.assertIsNotNone(job.heartbeat)
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            jobs.submit("unknown")
+
+    def test_done_and_failed(self):
+        jobs.submit("import", table="Peers")
+        job = self.run_next(lambda job, progress: {"table": "Peers", "rows": 3})
+        self.assertEqual((job.status, job.processed), (JobStatus.DONE, 3))
+
+        def fail(job, progress):
+            raise ValueError("ошибка")
+
+        jobs.submit("import", table="Peers")
+        job = self.run_next(fail)
+        self.assertEqual((job.status, job.error), (JobStatus.FAILED, "ошибка"))
+
+    def test_abandoned_job_fails(self):
+        jobs.submit("import", table="Peers")
+        job = jobs.claim_next()
+        self.assertEqual(jobs.fail_abandoned(), 0)
+        stale = timezone.now() - timedelta(seconds=jobs.JOB_LEASE + 1)
+        Job.objects.filter(pk=job.pk).update(heartbeat=stale)
+        self.assertEqual(jobs.fail_abandoned(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, JobStatus.FAILED)
+
+    def test_call_submitted_only_by_post(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE FUNCTION fnc_test_one() RETURNS TABLE (one integer) "
+                "LANGUAGE sql AS $$ SELECT 1 $$"
+            )
+        bump_version(CATALOG)
+        url = reverse("sql:execute", kwargs={"name": "fnc_test_one"})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(Job.objects.exists())
+        response = self.client.post(url)
+        job = Job.objects.get()
+        self.assertRedirects(
+            response, reverse("sql:job", kwargs={"job_id": job.pk}), fetch_redirect_response=False
+        )
+        self.assertEqual(job.params["name"], "fnc_test_one")
+
+
+class KeysetPaginationTests(TestCase):
+    """Страницы таблицы по первичному ключу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            Peers.objects.create(nickname=f"peer{i}", birthday=date(2000, 1, 5 - i))
+
+    def test_pages_forward_and_back(self):
+        first = get_page(Peers, size=2)
+        self.assertEqual([row["nickname"] for row in first["rows"]], ["peer0", "peer1"])
+        self.assertIsNone(first["prev"])
+        second = get_page(Peers, after=first["next"], size=2)
+        self.assertEqual([row["nickname"] for row in second["rows"]], ["peer2", "peer3"])
+        back = get_page(Peers, before=second["prev"], size=2)
+        self.assertEqual(back["rows"], first["rows"])
+
+    def test_last_page_has_no_next(self):
+        page = get_page(Peers, after="peer2", size=2)
+        self.assertEqual([row["nickname"] for row in page["rows"]], ["peer3", "peer4"])
+        self.assertIsNone(page["next"])
+
+
+class FilterSortTests(TestCase):
+    """Фильтры и сортировка страницы таблицы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            Peers.objects.create(nickname=f"peer{i}", birthday=date(2000, 1, 5 - i))
+
+    def test_sort_by_column(self):
+        field = Peers._meta.get_field("birthday")
+        page = get_page(Peers, size=2, sort=(field, False))
+        self.assertEqual([row["nickname"] for row in page["rows"]], ["peer4", "peer3"])
+        page = get_page(Peers, after=page["next"], size=2, sort=(field, False))
+        self.assertEqual([row["nickname"] for row in page["rows"]], ["peer2", "peer1"])
+
+    def test_unknown_cursor(self):
+        field = Peers._meta.get_field("birthday")
+        with self.assertRaises(ValueError):
+            get_page(Peers, after="nobody", sort=(field, False))
+
+    def test_filter_range(self):
+        filters = parse_filters(get_table("Peers"), {"birthday__gte": "2000-01-03"})
+        page = get_page(Peers, filters=filters)
+        self.assertEqual([row["nickname"] for row in page["rows"]], ["peer0", "peer1", "peer2"])
+
+
+class ApiFieldsTests(TestCase):
+    """Выбор полей API: неизвестное поле - ошибка запроса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Peers.objects.create(nickname="alice", birthday=date(2000, 1, 1))
+
+    def test_list_and_retrieve(self):
+        detail = reverse("sql:api_peers-detail", kwargs={"pk": "alice"})
+        response = self.client.get(detail, {"fields": "birthday", "format": "json"})
+        self.assertEqual(response.json(), {"nickname": "alice", "birthday": "2000-01-01"})
+        for url in (reverse("sql:api_peers-list"), detail):
+            response = self.client.get(url, {"fields": "bogus", "format": "json"})
+            self.assertEqual(response.status_code, 400)
+
+
+class TableETagTests(TestCase):
+    """Условный GET страницы таблицы по версии таблицы."""
+
+    def test_not_modified_until_write(self):
+        url = reverse("sql:data_read", kwargs={"table": "Peers"})
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Peers.objects.create(nickname="alice")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_no_validators_on_error(self):
+        url = reverse("sql:data_read", kwargs={"table": "Peers"})
+        response = self.client.get(url, {"sort": "bogus"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("ETag"))
+        self.assertFalse(response.has_header("Last-Modified"))
+
+
+class JobResultETagTests(TempStoreMixin, TestCase):
+    """ETag результата задачи: слабый и только у завершенной."""
+
+    def create_job(self, status=JobStatus.DONE):
+        return Job.objects.create(
+            kind="call",
+            status=status,
+            params={"name": "fnc_test"},
+            result=save_result(["id"], [[1], [2]]) if status == JobStatus.DONE else None,
+        )
+
+    def url(self, job):
+        return reverse("sql:job_result", kwargs={"job_id": job.pk})
+
+    def test_weak_etag_varies_on_encoding(self):
+        url = self.url(self.create_job())
+        plain = self.client.get(url, {"format": "csv"})
+        packed = self.client.get(url, {"format": "csv"}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(b"".join(plain.streaming_content), b"id\r\n1\r\n2\r\n")
+        self.assertEqual(packed["Content-Encoding"], "gzip")
+        self.assertTrue(plain["ETag"].startswith('W/"'))
+        self.assertIn("Accept-Encoding", packed["Vary"])
+        response = self.client.get(url, {"format": "csv"}, HTTP_IF_NONE_MATCH=plain["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_etag_before_done(self):
+        response = self.client.get(self.url(self.create_job(JobStatus.RUNNING)))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response)
+
+
+class SelectQueryTests(SimpleTestCase):
+    """Запросы, которые читаются серверным курсором."""
+
+    def test_is_select(self):
+        self.assertTrue(is_select("-- comment\nSELECT 1;"))
+        self.assertTrue(is_select("WITH t AS (SELECT 1) SELECT * FROM t"))
+        self.assertTrue(is_select("SELECT ';'"))
+        self.assertFalse(is_select("SELECT 1; DELETE FROM t"))
+        self.assertFalse(is_select("UPDATE t SET a = 1"))
+
+
+class ResultStoreTests(TempStoreMixin, TestCase):
+    """Хранилище результатов: блоки, чтение среза и удаление."""
+
+    def test_read_slices(self):
+        rows = [[i, f"row{i}"] for i in range(25)]
+        with override_settings(RESULT_STORE={"LOCATION": self.store, "BLOCK_ROWS": 10}):
+            stored = save_result(["id", "name"], rows)
+            self.assertEqual(stored["rows"], 25)
+            self.assertEqual(read_result(stored["handle"], 8, 5), rows[8:13])
+            self.assertEqual(read_result(stored["handle"], 20), rows[20:])
+            self.assertEqual([len(block) for block in iter_result(stored["handle"])], [10, 10, 5])
+
+    def test_same_result_stored_once(self):
+        first = save_result(["id"], [[1], [2]])
+        second = save_result(["id"], [[1], [2]])
+        self.assertEqual(first["handle"], second["handle"])
+        self.assertEqual(len(os.listdir(self.store)), 2)
+
+    def test_purged_result(self):
+        handle = save_result(["id"], [[1]])["handle"]
+        os.remove(result_path(handle, "dat"))
+        with self.assertRaises(LookupError):
+            iter_result(handle)
+
+    def test_purged_job_result(self):
+        job = Job.objects.create(
+            kind="call",
+            status=JobStatus.DONE,
+            params={"name": "fnc_test"},
+            result=save_result(["id"], [[1]]),
+        )
+        os.remove(result_path(job.result["handle"], "idx"))
+        url = reverse("sql:job_result", kwargs={"job_id": job.pk})
+        self.assertEqual(self.client.get(url, {"format": "csv"}).status_code, 410)
+        self.assertEqual(self.client.get(url).status_code, 410)
+
+
+class NormalizeTests(SimpleTestCase):
+    """Нормализация медленных запросов для группировки по отпечатку."""
+
+    def test_literals_and_lists(self):
+        self.assertEqual(
+            normalize("SELECT * FROM t WHERE a = 5 AND b IN (1, 2, 3) AND c = 'x''y'"),
+            "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?",
+        )
+        self.assertEqual(
+            normalize("INSERT INTO t VALUES (%s, %s), (%s, %s)"),
+            "INSERT INTO t VALUES (?, ?), ...",
+        )
+
+    def test_identifiers_kept(self):
+        self.assertEqual(normalize('SELECT "t1".id FROM "t1"'), 'SELECT "t1".id FROM "t1"')
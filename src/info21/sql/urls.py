@@ -1,12 +1,18 @@
-from django.urls import path
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import api, views
 
 app_name = "sql"
 
+router = DefaultRouter()
+for table_name, viewset in api.build_viewsets().items():
+    router.register(table_name, viewset, basename=api.api_basename(table_name))
+
 urlpatterns = [
     path("", views.index, name="index"),
     path("data/", views.data, name="data"),
+    path("data/snapshot", views.data_snapshot, name="data_snapshot"),
     path("data/<str:table>/read", views.data_read, name="data_read"),
     path("data/<str:table>/create", views.data_create, name="data_create"),
     path("data/<str:table>/<pk>/update", views.data_update, name="data_update"),
@@ -14,17 +20,14 @@ urlpatterns = [
     path("data/<str:table>/export", views.data_export, name="data_export"),
     path("data/<str:table>/import", views.data_import, name="data_import"),
     path("data/<str:table>/table_delete", views.table_delete, name="table_delete"),
+    path("metrics", views.metrics, name="metrics"),
     path("operation/", views.operation, name="operation"),
+    path("operation/stats", views.operation_stats, name="operation_stats"),
+    path("operation/slow", views.operation_slow, name="operation_slow"),
     path("operation/execute_sql/", views.execute_sql, name="execute_sql"),
-    path(
-        "operation/execute_form/<str:type_sql>/<str:name>",
-        views.execute_form,
-        name="execute_form",
-    ),
-    path(
-        "operation/execute/<str:type_sql>/<str:name>/<str:params>",
-        views.execute,
-        name="execute",
-    ),
-    path("export_csv/", views.export_csv, name="export_csv"),
+    path("operation/execute/<str:name>", views.execute, name="execute"),
+    path("operation/execute/<str:name>/download", views.download, name="download"),
+    path("jobs/<int:job_id>", views.job, name="job"),
+    path("jobs/<int:job_id>/result", views.job_result, name="job_result"),
+    path("api/", include(router.urls)),
 ]
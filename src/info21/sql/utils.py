@@ -1,24 +1,59 @@
 import csv
-import os
+import io
+import re
+from contextlib import nullcontext
 from typing import Union
 
-from django.apps import apps
+import sqlparse
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import connection
-from django.forms import modelform_factory
-from django.http import HttpResponse, HttpResponseNotFound
+from django.core.files.uploadhandler import StopUpload
+from django.db import (DatabaseError, NotSupportedError, connection,
+                       transaction)
+from django.db.models import F, Q
+from django.http import (HttpResponseBadRequest, HttpResponseNotFound, QueryDict,
+                         StreamingHttpResponse)
+from django.http.multipartparser import MultiPartParser, MultiPartParserError
+from django.middleware.csrf import CsrfViewMiddleware
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.datastructures import MultiValueDict
+from django.utils.safestring import mark_safe
 
-from .import_obj import (import_checks, import_friends, import_p2p,
-                         import_peers, import_recommendations, import_tasks,
-                         import_time_tracking, import_transferred_points,
-                         import_verter, import_xp)
+from .export_obj import gzip_chunks, iter_copy, iter_csv, iter_snapshot
+from .import_obj import IMPORT_FUNCS, ImportUploadHandler, import_order
+from .jobs import submit
+from .matviews import query_matviews, refresh_matviews
+from .procedures import CATALOG
+from .registry import get_table
+from .stats import explain_locally, profile, timed
+from .versions import bump_version
+
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+# Количество строк на странице таблицы по умолчанию и максимальное
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+# Команды, после которых каталог процедур перестраивается
+DDL_COMMANDS = ("CREATE", "ALTER", "DROP", "COMMENT")
+# Параметры страницы таблицы, не являющиеся фильтрами
+PAGE_PARAMS = ("after", "before", "size", "sort")
+# Запросы, результат которых читается серверным курсором: DECLARE CURSOR
+# принимает только SELECT, VALUES и TABLE, в том числе после WITH
+SELECT_QUERY = re.compile(
+    r"^\s*(?:(?:--[^\n]*(?:\n|$)|/\*.*?\*/)\s*)*\(*\s*(SELECT|WITH|VALUES|TABLE)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+# Метки, по которым шаблон результата делится на части при потоковой отдаче
+ROWS_MARK = mark_safe("<!-- rows -->")
+NOTICE_MARK = mark_safe("<!-- notice -->")
 
 
 # Абстрактный метод для добавления объекта
 def create_obj(request, table_name: str):
     try:
-        model = apps.get_model(app_label="sql", model_name=table_name)
+        table = get_table(table_name)
     except LookupError as err:
         request.logger.error(
             "%s %s %s %s %s",
@@ -29,8 +64,7 @@ def create_obj(request, table_name: str):
             str(err),
         )
         return HttpResponseNotFound("Такой таблицы не существует!")
-    model_form = modelform_factory(model, exclude=[])
-    form = model_form(request.POST or None)
+    form = table.form(request.POST or None)
     if form.is_valid():
         form.save()
         return redirect("sql:data_read", table=table_name)
@@ -41,13 +75,8 @@ def create_obj(request, table_name: str):
 # Абстрактный метод для удаления объекта
 def delete_obj(request, table_name: str, obj_pk: Union[int, str]):
     try:
-        model = apps.get_model(app_label="sql", model_name=table_name)
-        if table_name == "Peers":
-            obj = model.objects.get(nickname=obj_pk)
-        elif table_name == "Tasks":
-            obj = model.objects.get(title=obj_pk)
-        else:
-            obj = model.objects.get(id=obj_pk)
+        table = get_table(table_name)
+        obj = table.model.objects.get(pk=obj_pk)
         obj.delete()
     except ObjectDoesNotExist as err:
         request.logger.error(
@@ -85,14 +114,8 @@ def delete_obj(request, table_name: str, obj_pk: Union[int, str]):
 # Абстрактный метод для обновления объекта
 def update_obj(request, table_name: str, obj_pk: Union[int, str]):
     try:
-        model = apps.get_model(app_label="sql", model_name=table_name)
-        if table_name == "Peers":
-            obj = model.objects.get(nickname=obj_pk)
-        elif table_name == "Tasks":
-            obj = model.objects.get(title=obj_pk)
-        else:
-            obj = model.objects.get(id=obj_pk)
-        model_form = modelform_factory(model, exclude=[])
+        table = get_table(table_name)
+        obj = table.model.objects.get(pk=obj_pk)
     except ObjectDoesNotExist as err:
         request.logger.error(
             "%s %s %s %s %s",
@@ -124,11 +147,11 @@ def update_obj(request, table_name: str, obj_pk: Union[int, str]):
         )
         return HttpResponseNotFound("Такой таблицы не существует!")
     if request.method == "POST":
-        form = model_form(request.POST, instance=obj)
+        form = table.form(request.POST, instance=obj)
         if form.is_valid():
             form.save()
             return redirect("sql:data_read", table=table_name)
-    form = model_form(instance=obj)
+    form = table.form(instance=obj)
     context = {"form": form, "title": table_name}
     return render(request, "sql/update.html", context)
 
@@ -136,8 +159,7 @@ def update_obj(request, table_name: str, obj_pk: Union[int, str]):
 # Абстрактный метод для экпорта данных
 def export_table(request, table_name: str):
     try:
-        model = apps.get_model(app_label="sql", model_name=table_name)
-        data = model.objects.all()
+        model = get_table(table_name).model
     except LookupError as err:
         request.logger.error(
             "%s %s %s %s %s",
@@ -148,40 +170,24 @@ def export_table(request, table_name: str):
             str(err),
         )
         return HttpResponseNotFound("Такой таблицы не существует!")
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = f"attachment; filename={table_name}.csv"
-    writer = csv.writer(response)
-    if table_name in ["Peers", "Tasks"]:
-        field_names = [field.db_column for field in model._meta.fields]
-    else:
-        field_names = ["ID"] + [
-            field.db_column for field in model._meta.fields if field.db_column
-        ]
-    writer.writerow(field_names)
-    for row in data:
-        obj = [getattr(row, field.attname) for field in model._meta.fields]
-        writer.writerow(obj)
+    chunks = iter_copy(model) if connection.vendor == "postgresql" else iter_csv(model)
+    return csv_response(request, chunks, table_name)
+
+
+# Абстрактный метод для экспорта всех таблиц одним архивом
+def export_snapshot(request):
+    models = [get_table(name).model for name in import_order()]
+    response = StreamingHttpResponse(iter_snapshot(models), content_type="application/zip")
+    filename = timezone.now().strftime("info21_%Y-%m-%d_%H-%M-%S.zip")
+    response["Content-Disposition"] = f"attachment; filename={filename}"
     return response
 
 
 # Абстрактный метод для импорта данных
 def import_table(request, table_name: str):
-    import_func = {
-        "Checks": import_checks,
-        "Friends": import_friends,
-        "P2P": import_p2p,
-        "Peers": import_peers,
-        "Recommendations": import_recommendations,
-        "Tasks": import_tasks,
-        "TimeTracking": import_time_tracking,
-        "TransferredPoints": import_transferred_points,
-        "Verter": import_verter,
-        "XP": import_xp,
-    }
-    func = import_func.get(table_name)
-    if func:
-        func()
-        return redirect("sql:data_read", table=table_name)
+    if table_name in IMPORT_FUNCS:
+        job = submit("import", table=table_name)
+        return redirect("sql:job", job_id=job.pk)
     else:
         request.logger.error(
             "%s %s %s %s %s",
@@ -193,11 +199,90 @@ def import_table(request, table_name: str):
         return HttpResponseNotFound("Такой таблицы не существует!")
 
 
+# Абстрактный метод для потокового импорта файла, загруженного пользователем
+def upload_table(request, table_name: str):
+    try:
+        model = get_table(table_name).model
+    except LookupError as err:
+        request.logger.error(
+            "%s %s %s %s %s",
+            request.method,
+            request.path,
+            request.META.get("REMOTE_ADDR"),
+            "There is no such table: ",
+            str(err),
+        )
+        return HttpResponseNotFound("Такой таблицы не существует!")
+    try:
+        # Строки загружаются в одной транзакции: при ошибке в середине файла
+        # таблица не остается загруженной частично
+        with transaction.atomic():
+            response = receive_upload(request, table_name, model)
+    except (ValueError, DatabaseError, MultiPartParserError) as err:
+        request.logger.error(
+            "%s %s %s %s %s",
+            request.method,
+            request.path,
+            request.META.get("REMOTE_ADDR"),
+            "Error in importing uploaded file: ",
+            str(err),
+        )
+        return HttpResponseBadRequest(f"Ошибка при импорте файла: {err}")
+    return response
+
+
+# Проверка токена CSRF без чтения тела запроса: middleware получает токен
+# через заголовок, а пустые POST и FILES не дают ему разбирать тело
+def check_csrf(request, token: str):
+    request.META[settings.CSRF_HEADER_NAME] = token
+    request._post, request._files = QueryDict(), MultiValueDict()
+    try:
+        middleware = CsrfViewMiddleware(lambda request: None)
+        middleware.process_request(request)
+        return middleware.process_view(request, None, (), {})
+    finally:
+        del request._post, request._files
+
+
+# Разбор тела запроса: строки загружаются в БД по мере получения. Токен CSRF
+# проверяется до первого файла: из заголовка X-CSRFToken или из поля
+# csrfmiddlewaretoken, которое в форме идет перед файлом. Без верного
+# токена чтение тела прекращается, и файл не загружается
+def receive_upload(request, table_name: str, model):
+    header = request.META.get(settings.CSRF_HEADER_NAME)
+    rejected = []
+
+    def before_file():
+        if rejected:
+            raise StopUpload(connection_reset=True)
+        token = header if header is not None else parser._post.get("csrfmiddlewaretoken", "")
+        response = check_csrf(request, token)
+        if response is not None:
+            rejected.append(response)
+            raise StopUpload(connection_reset=True)
+
+    handler = ImportUploadHandler(model, request, before_file=before_file)
+    parser = MultiPartParser(request.META, request, [handler], request.encoding)
+    request._post, request._files = parser.parse()
+    if rejected:
+        return rejected[0]
+    if not handler.stats:
+        return HttpResponseBadRequest("Файл для импорта не выбран!")
+    for stats in handler.stats:
+        request.logger.info(
+            "%s %s %s %s",
+            request.method,
+            request.path,
+            request.META.get("REMOTE_ADDR"),
+            stats,
+        )
+    return redirect("sql:data_read", table=table_name)
+
+
 # Абстрактный метод для удаления таблиц
 def delete_table(request, table_name: str):
     try:
-        model = apps.get_model(app_label="sql", model_name=table_name)
-        model.objects.all().delete()
+        get_table(table_name)
     except LookupError as err:
         request.logger.warning(
             "%s %s %s %s %s",
@@ -208,94 +293,323 @@ def delete_table(request, table_name: str):
             str(err),
         )
         return HttpResponseNotFound("Такой таблицы не существует!")
-    return redirect("sql:data_read", table=table_name)
+    job = submit("delete_table", table=table_name)
+    return redirect("sql:job", job_id=job.pk)
+
 
+# Фильтры страницы таблицы из параметров запроса. Допустимы только
+# параметры из реестра таблиц, значения приводятся к типу поля
+def parse_filters(table, params):
+    filters = {}
+    for param, value in params.items():
+        if param in PAGE_PARAMS or value == "":
+            continue
+        if param not in table.filters:
+            raise ValueError(f"Недопустимый фильтр: {param}")
+        field, lookup = table.filters[param]
+        target = field.target_field if field.is_relation else field
+        value = value if lookup == "startswith" else target.to_python(value)
+        # Для внешних ключей условие ставится на столбец ключа, без JOIN
+        path = f"{field.name}__{target.name}" if field.is_relation else field.name
+        filters[f"{path}__{lookup}"] = value
+    return filters
 
-# Абстрактный метод для получения verbose_name полей модели
-def get_verbose_names(model):
-    verbose_names = []
-    for field in model._meta.fields:
-        verbose_names.append(field.verbose_name)
-    return verbose_names
 
+# Поле сортировки: имя поля, с "-" - по убыванию
+def parse_sort(table, value: str):
+    descending = value.startswith("-")
+    name = value.lstrip("-")
+    for field in table.model._meta.fields:
+        if field.name == name:
+            return field, descending
+    raise ValueError(f"Недопустимое поле сортировки: {value}")
 
-# Получаем список процедур и функций из БД
-def get_list_proc():
+
+# Условие keyset для строк, идущих после строки (key, pk) в порядке
+# key ASC NULLS LAST, pk ASC или key DESC NULLS FIRST, pk DESC
+def seek(key: str, value, pk, descending: bool):
+    if key == "pk":
+        return Q(pk__lt=pk) if descending else Q(pk__gt=pk)
+    if descending:
+        if value is None:
+            return Q(**{f"{key}__isnull": True, "pk__lt": pk}) | Q(**{f"{key}__isnull": False})
+        return Q(**{f"{key}__lt": value}) | Q(**{key: value, "pk__lt": pk})
+    if value is None:
+        return Q(**{f"{key}__isnull": True, "pk__gt": pk})
+    return (
+        Q(**{f"{key}__gt": value})
+        | Q(**{key: value, "pk__gt": pk})
+        | Q(**{f"{key}__isnull": True})
+    )
+
+
+# Страница таблицы (keyset): строки после after или перед before в порядке
+# поля сортировки и первичного ключа, без OFFSET. Курсор - первичный ключ
+# строки, значение поля сортировки для него читается по индексу PK.
+# Запрашивается на одну строку больше, чтобы узнать, есть ли следующая страница
+def get_page(
+    model,
+    after=None,
+    before=None,
+    size: int = PAGE_SIZE,
+    filters=None,
+    sort=None,
+    columns=None,
+):
+    pk = model._meta.pk
+    field, descending = sort or (pk, False)
+    key = "pk" if field.primary_key else field.attname
+    rows = model.objects.values(*(columns or [])).filter(**(filters or {}))
+    cursor = before if before is not None else after
+    # Страница "назад" читается в обратном порядке и затем разворачивается
+    reverse = descending != (before is not None)
+    if reverse:
+        rows = rows.order_by(F(key).desc(nulls_first=True), "-pk")
+    else:
+        rows = rows.order_by(F(key).asc(nulls_last=True), "pk")
+    if cursor is not None:
+        value = None
+        if key != "pk":
+            values = model.objects.filter(pk=cursor).values_list(key, flat=True)
+            if not values:
+                raise ValueError(f"Строка {cursor} не найдена")
+            value = values[0]
+        rows = rows.filter(seek(key, value, cursor, reverse))
+    rows = list(rows[: size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    if before is not None:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+    return {
+        "rows": rows,
+        "size": size,
+        "prev": rows[0][pk.attname] if rows and has_prev else None,
+        "next": rows[-1][pk.attname] if rows and has_next else None,
+    }
+
+
+# Приблизительное число строк по статистике PostgreSQL, без COUNT(*).
+# Если таблица еще не анализировалась, возвращается None
+def estimate_count(model):
+    if connection.vendor != "postgresql":
+        return None
     with connection.cursor() as cursor:
         cursor.execute(
-            """
-            SELECT
-            CASE
-            WHEN pg_get_function_result(p.oid) IS NULL THEN 'PROCEDURE'
-            ELSE 'FUNCTION'
-            END AS type,
-            proname AS procedure_function_name,
-            pg_get_function_identity_arguments(p.oid) AS parameters,
-            pg_get_function_result(p.oid) AS return_type
-            FROM
-            pg_proc p
-            LEFT JOIN pg_namespace n ON p.pronamespace = n.oid
-            WHERE
-            n.nspname = 'public'
-            AND (
-            pg_get_function_result(p.oid) != 'trigger'
-            OR pg_get_function_result(p.oid) IS NULL
-            );
-            """
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [connection.ops.quote_name(model._meta.db_table)],
         )
-        procedures = cursor.fetchall()
-        column = [col[0] for col in cursor.description]
-        column.append("description")
-        funcs = {}
-        file = os.path.abspath(__file__).replace(
-            os.path.basename(__file__), "../data/funcs.csv"
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+# Число команд в тексте запроса без пустых и состоящих из комментариев
+def count_statements(query: str):
+    return sum(
+        1
+        for statement in sqlparse.split(query)
+        if sqlparse.format(statement, strip_comments=True).strip(" \t\r\n;")
+    )
+
+
+# Запрос можно выполнить серверным курсором: DECLARE CURSOR принимает одну
+# команду, несколько команд выполняются обычным курсором
+def is_select(query: str):
+    return SELECT_QUERY.match(query) is not None and count_statements(query) == 1
+
+
+# Чтение результата запроса через именованный (серверный) курсор: первым
+# значением возвращаются столбцы, затем списки не более чем по chunk_size
+# строк. Курсор живет в транзакции, которая закрывается вместе с генератором.
+# Время выполнения не включает отправку строк клиенту, а план берется только
+# из auto_explain: повторный EXPLAIN выполнил бы запрос еще раз целиком
+def iter_query(query: str, chunk_size: int = None, explain: bool = False):
+    chunk_size = chunk_size or settings.SQL_FETCH_SIZE
+    with profile("SQL", "SQL", query, explain=explain, streamed=True) as execution:
+        execution.rows = 0
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            explain_locally()
+            with timed(execution):
+                cursor.execute(query)
+                # У именованного курсора описание столбцов появляется после чтения
+                rows = cursor.fetchmany(chunk_size)
+            yield [col[0] for col in cursor.description]
+            while rows:
+                execution.rows += len(rows)
+                yield rows
+                with timed(execution):
+                    rows = cursor.fetchmany(chunk_size)
+
+
+# Выполняем произвольный запрос. Возвращает столбцы и итератор по спискам
+# строк; ошибки самого запроса возникают здесь, до отправки ответа.
+# Запросы на чтение читаются серверным курсором по мере отправки, остальные
+# выполняются сразу в режиме autocommit, а для плана (explain) - в
+# транзакции, в которой включается auto_explain
+def custom_sql(query: str, explain: bool = False):
+    matviews = query_matviews(query)
+    if matviews:
+        refresh_matviews(matviews)
+    if is_select(query):
+        chunks = iter_query(query, explain=explain)
+        try:
+            return next(chunks), chunks
+        except NotSupportedError:
+            # WITH с INSERT, UPDATE или DELETE нельзя открыть курсором
+            if not query.lstrip().upper().startswith("WITH"):
+                raise
+    with profile("SQL", "SQL", query, explain=explain) as execution:
+        explained = explain and getattr(connection, "auto_explain", False)
+        with transaction.atomic() if explained else nullcontext(), connection.cursor() as cursor:
+            explain_locally()
+            cursor.execute(query)
+            execution.rows = cursor.rowcount
+            status = cursor.cursor.statusmessage
+            # Запрос мог изменить процедуры или функции
+            if status.split(" ")[0] in DDL_COMMANDS:
+                bump_version(CATALOG)
+            if cursor.description is None:
+                return ["Результат"], iter([[(status,)]])
+            column = [col[0] for col in cursor.description]
+            return column, iter([cursor.fetchmany(settings.SQL_DISPLAY_ROWS + 1)])
+
+
+# Полный результат запроса в CSV кусками по SQL_FETCH_SIZE строк
+def iter_query_csv(columns: list, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+# Страница результата отдается по частям: начало шаблона, строки таблицы
+# кусками и конец шаблона. Показывается не больше SQL_DISPLAY_ROWS строк,
+# после чего курсор закрывается
+def stream_result(request, columns: list, chunks, query: str):
+    limit = settings.SQL_DISPLAY_ROWS
+    page = render_to_string(
+        "sql/result_sql.html",
+        {"column": columns, "stream": ROWS_MARK, "stream_notice": NOTICE_MARK},
+        request,
+    )
+    head, rest = page.split(ROWS_MARK)
+    middle, tail = rest.split(NOTICE_MARK)
+
+    def generate():
+        yield head
+        shown, truncated, error = 0, False, None
+        try:
+            for rows in chunks:
+                part = rows[: limit - shown]
+                yield render_to_string("includes/result_rows.html", {"rows": part})
+                shown += len(part)
+                if shown >= limit:
+                    truncated = len(part) < len(rows) or next(chunks, None) is not None
+                    break
+        except DatabaseError as err:
+            request.logger.warning(
+                "%s %s %s %s %s",
+                request.method,
+                request.path,
+                request.META.get("REMOTE_ADDR"),
+                "Error in execution custom sql query: ",
+                str(err),
+            )
+            error = str(err)
+        finally:
+            # Закрытие генератора закрывает курсор и его транзакцию
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        yield middle
+        yield render_to_string(
+            "includes/result_notice.html",
+            {
+                "limit": limit,
+                "truncated": truncated,
+                "error": error,
+                "query": query if is_select(query) else None,
+            },
+            request,
         )
-        with open(file, "r", encoding="utf8") as f:
-            for i in csv.reader(f, delimiter="|"):
-                funcs[i[0].lower()] = i[1]
-        for i in range(len(procedures)):
-            try:
-                procedures[i] = [*procedures[i], str(funcs[procedures[i][1]])]
-            except KeyError:
-                procedures[i] = [*procedures[i], None]
-        return column, procedures
-
-
-# Получаем список столбцов и строк из БД
-def custom_sql(query: str, to_file: bool):
-    with connection.cursor() as cursor:
-        cursor.execute(query)
-        row = cursor.fetchall()
-        column = [col[0] for col in cursor.description]
-        if to_file:
-            file = os.path.abspath(__file__).replace(
-                os.path.basename(__file__), "../data/custom_sql.csv"
+        yield tail
+
+    return StreamingHttpResponse(generate())
+
+
+# Результат процедуры или функции через курсор procedure_result: процедура
+# открывает его сама, для функции он объявляется. Первым значением
+# возвращаются столбцы, затем порции по SQL_FETCH_SIZE строк. Курсор
+# закрывается в той же транзакции, при ошибке его освобождает откат
+def iter_call(kind: str, name: str, params: list):
+    fetch = f"FETCH {int(settings.SQL_FETCH_SIZE)} FROM procedure_result"
+    placeholders = ", ".join(["%s"] * len(params))
+    with transaction.atomic(), connection.cursor() as cursor:
+        explain_locally()
+        if kind == "PROCEDURE":
+            cursor.execute(
+                f"CALL {name}({placeholders}{', ' if params else ''}%s)",
+                [*params, "procedure_result"],
             )
-            with open(file, "w", encoding="utf8") as f:
-                writer = csv.writer(f)
-                writer.writerow(column)
-                for i in row:
-                    writer.writerow(i)
-        return column, row
+        else:
+            cursor.execute(
+                f"DECLARE procedure_result NO SCROLL CURSOR FOR SELECT * FROM {name}({placeholders})",
+                params,
+            )
+        cursor.execute(fetch)
+        yield [col[0] for col in cursor.description]
+        while rows := cursor.fetchall():
+            yield rows
+            cursor.execute(fetch)
+        cursor.execute("CLOSE procedure_result")
 
 
 # Вызов процедуры
 def call_proc(proc_name: str, params: list):
-    with connection.cursor() as cursor:
-        params.append("procedure_result")
-        cursor.execute("BEGIN")
-        cursor.execute(
-            "CALL " + proc_name + "(" + "%s" + ", %s" * (len(params) - 1) + ")", params
-        )
-        cursor = connection.create_cursor("procedure_result")
-        result = cursor.fetchall()
-        column = [col[0] for col in cursor.description]
-        return column, result
+    chunks = iter_call("PROCEDURE", proc_name, params)
+    column = next(chunks)
+    return column, [row for rows in chunks for row in rows]
+
+
+# Результат для скачивания: столбцы и итератор по порциям строк. Ошибки
+# вызова возникают здесь, до отправки ответа
+def call_chunks(procedure, params: list):
+    if procedure.matviews:
+        refresh_matviews(procedure.matviews)
+    chunks = iter_call(procedure.type, procedure.name, list(params))
+    return next(chunks), chunks
 
 
-# Вызов функции
+# Ответ с CSV: сжатый файл по ?compress=1, иначе сжатие при передаче, если
+# клиент его поддерживает
+def csv_response(request, chunks, filename: str):
+    if "1" in (request.GET.get("compress"), request.POST.get("compress")):
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type="application/gzip")
+        response["Content-Disposition"] = f"attachment; filename={filename}.csv.gz"
+        return response
+    if ACCEPTS_GZIP.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type="text/csv")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = StreamingHttpResponse(chunks, content_type="text/csv")
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = f"attachment; filename={filename}.csv"
+    return response
+
+
+# Вызов функции; при ошибке откатывается только ее точка сохранения
 def call_func(func_name: str, params: list):
-    with connection.cursor() as cursor:
+    with transaction.atomic(), connection.cursor() as cursor:
+        explain_locally()
         cursor.callproc(func_name, params)
         result = cursor.fetchall()
         column = [col[0] for col in cursor.description]
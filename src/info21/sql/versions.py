@@ -0,0 +1,64 @@
+from functools import wraps
+
+from django.db.models import F
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import TableVersion
+
+
+# Версии таблиц одним запросом: таблица -> (версия, дата изменения)
+def table_versions(tables):
+    return {
+        row.table: (row.version, row.modified)
+        for row in TableVersion.objects.filter(table__in=tables)
+    }
+
+
+# Увеличение версии вне триггеров, например для каталога процедур
+def bump_version(name: str):
+    updated = TableVersion.objects.filter(table=name).update(
+        version=F("version") + 1, modified=timezone.now()
+    )
+    if not updated:
+        TableVersion.objects.get_or_create(table=name, defaults={"version": 1})
+
+
+def versions_etag(versions: dict):
+    tag = "-".join(f"{table}.{version}" for table, (version, _) in sorted(versions.items()))
+    return f'W/"{tag}"'
+
+
+# Условный GET по версиям таблиц: get_tables(request, *args, **kwargs)
+# возвращает таблицы, из которых читает представление. Если версии не
+# изменились, ответ 304 отдается без запросов к самим таблицам. Ошибка,
+# например 400 из-за неверного фильтра, отдается без валидаторов, чтобы
+# клиент не сохранил ее как представление страницы
+def conditional_on_tables(get_tables):
+    def versions(request, *args, **kwargs):
+        if not hasattr(request, "table_versions"):
+            request.table_versions = table_versions(get_tables(request, *args, **kwargs))
+        return request.table_versions
+
+    def etag(request, *args, **kwargs):
+        current = versions(request, *args, **kwargs)
+        return versions_etag(current) if current else None
+
+    def last_modified(request, *args, **kwargs):
+        current = versions(request, *args, **kwargs)
+        return max(modified for _, modified in current.values()) if current else None
+
+    def decorator(func):
+        conditional = condition(etag_func=etag, last_modified_func=last_modified)(func)
+
+        @wraps(func)
+        def inner(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if not (200 <= response.status_code < 300 or response.status_code == 304):
+                del response["ETag"]
+                del response["Last-Modified"]
+            return response
+
+        return inner
+
+    return decorator
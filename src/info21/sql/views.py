@@ -1,19 +1,33 @@
-import csv
-import datetime
-import os
-import re
-from decimal import Decimal
+import json
 from typing import Union
 
-from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
 from django.db.utils import DatabaseError, OperationalError
-from django.http import HttpResponseBadRequest
-from django.shortcuts import redirect, render
+from django.http import (HttpResponse, HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 
 from .forms import DynamicForm
-from .utils import (call_func, call_proc, create_obj, custom_sql, delete_obj,
-                    delete_table, export_table, get_list_proc,
-                    get_verbose_names, import_table, update_obj)
+from .jobs import submit
+from .metrics import CONTENT_TYPE, render_metrics
+from .models import Job, JobStatus
+from .procedures import cache_stats, get_procedure, get_procedures
+from .registry import DATA_TABLES, get_table
+from .results import StoredRows, iter_result
+from .slowlog import SLOW_ORDER, slow_queries
+from .stats import routine_stats
+from .utils import (MAX_PAGE_SIZE, PAGE_SIZE, call_chunks, create_obj,
+                    csv_response, custom_sql, delete_obj, delete_table,
+                    estimate_count, export_snapshot, export_table, get_page,
+                    import_table, is_select, iter_query_csv, parse_filters,
+                    parse_sort, stream_result, update_obj, upload_table)
+from .versions import conditional_on_tables
 
 
 def index(request):
@@ -24,27 +38,15 @@ def index(request):
 
 
 def data(request):
-    model_names = [
-        "P2P",
-        "XP",
-        "Checks",
-        "Friends",
-        "Peers",
-        "Recommendations",
-        "Tasks",
-        "TimeTracking",
-        "TransferredPoints",
-        "Verter",
-    ]
-    context = {"data": model_names, "title": "Данные"}
+    context = {"data": DATA_TABLES, "title": "Данные"}
     return render(request, "sql/data.html", context)
 
 
+@conditional_on_tables(lambda request, table: [table])
 def data_read(request, table: str):
     try:
-        model = apps.get_model(app_label="sql", model_name=table)
-        data = model.objects.all()
-        verbose_names = get_verbose_names(model)
+        meta = get_table(table)
+        model = meta.model
     except LookupError as err:
         request.logger.error(
             "%s %s %s %s %s",
@@ -55,9 +57,43 @@ def data_read(request, table: str):
             str(err),
         )
         return HttpResponseBadRequest("Такой таблицы не существует!")
+    try:
+        size = min(max(int(request.GET.get("size", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after, before = (
+            meta.pk.to_python(request.GET[key]) if request.GET.get(key) else None
+            for key in ("after", "before")
+        )
+        filters = parse_filters(meta, request.GET)
+        sort = parse_sort(meta, request.GET["sort"]) if request.GET.get("sort") else None
+        page = get_page(model, after, before, size, filters, sort)
+    except (ValueError, ValidationError) as err:
+        request.logger.error(
+            "%s %s %s %s %s",
+            request.method,
+            request.path,
+            request.META.get("REMOTE_ADDR"),
+            "Incorrect page parameters: ",
+            str(err),
+        )
+        return HttpResponseBadRequest("Некорректные параметры страницы!")
+    # Фильтры и сортировка сохраняются в ссылках на соседние страницы
+    query = request.GET.copy()
+    for key in ("after", "before"):
+        query.pop(key, None)
+    query["size"] = size
     context = {
-        "data": data,
-        "fields": verbose_names,
+        "data": page["rows"],
+        "page": page,
+        "first": after is None and before is None,
+        "count": estimate_count(model),
+        "query": query.urlencode(),
+        "filtered": bool(filters),
+        "filters": [
+            (param, label, request.GET.get(param, "")) for param, label in meta.filter_inputs
+        ],
+        "sort": request.GET.get("sort", meta.pk.name),
+        "sort_fields": [(field.name, field.verbose_name) for field in model._meta.fields],
+        "fields": meta.verbose_names,
         "title": table,
     }
     return render(request, "sql/read.html", context)
@@ -75,11 +111,21 @@ def data_delete(request, table: str, pk: Union[int, str]):
     return delete_obj(request, table, pk)
 
 
+@conditional_on_tables(lambda request, table: [table])
 def data_export(request, table: str):
     return export_table(request, table)
 
 
+@conditional_on_tables(lambda request: DATA_TABLES)
+def data_snapshot(request):
+    return export_snapshot(request)
+
+
+# Токен CSRF загрузки проверяется в upload_table до чтения файла
+@csrf_exempt
 def data_import(request, table: str):
+    if request.method == "POST":
+        return upload_table(request, table)
     return import_table(request, table)
 
 
@@ -88,20 +134,54 @@ def table_delete(request, table: str):
 
 
 def operation(request):
-    column, procedures = get_list_proc()
-    context = {"title": "Операции", "column": column, "procedures": procedures}
+    context = {
+        "title": "Операции",
+        "procedures": get_procedures().values(),
+        "cache": cache_stats(),
+    }
     return render(request, "sql/operation.html", context)
 
 
+# Метрики всех процессов приложения в формате Prometheus
+def metrics(request):
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+# Перцентили времени выполнения процедур и их последние планы
+def operation_stats(request):
+    stats = routine_stats()
+    for row in stats:
+        if row["plan"] is not None:
+            row["plan_text"] = json.dumps(row["plan"].plan, indent=2, ensure_ascii=False)
+    context = {
+        "title": "Статистика выполнения",
+        "stats": stats,
+        "days": settings.SQL_STATS_DAYS,
+        "threshold": settings.SQL_EXPLAIN_MIN_MS,
+    }
+    return render(request, "sql/stats.html", context)
+
+
+# Медленные запросы к БД, сгруппированные по нормализованному тексту
+def operation_slow(request):
+    order = request.GET.get("order", "total")
+    if order not in SLOW_ORDER:
+        order = "total"
+    context = {
+        "title": "Медленные запросы",
+        "queries": slow_queries(order),
+        "order": order,
+        "threshold": settings.SQL_SLOW_QUERY_MS,
+        "days": settings.SQL_STATS_DAYS,
+    }
+    return render(request, "sql/slow.html", context)
+
+
 def execute_sql(request):
     if request.method == "POST":
         sql_query = request.POST.get("sql_query")
-        save_results = bool("save_results" in request.POST)
         try:
-            columns, rows = custom_sql(sql_query, save_results)
-            return render(
-                request, "sql/result_sql.html", {"column": columns, "rows": rows}
-            )
+            columns, chunks = custom_sql(sql_query, explain="explain" in request.POST)
         except (ValueError, TypeError, OperationalError, DatabaseError) as err:
             request.logger.warning(
                 "%s %s %s %s %s",
@@ -112,84 +192,44 @@ def execute_sql(request):
                 str(err),
             )
             return render(request, "sql/result_sql.html", {"error_message": str(err)})
+        # Полный результат запроса на чтение отдается файлом без ограничения строк
+        if "save_results" in request.POST and is_select(sql_query):
+            response = StreamingHttpResponse(
+                iter_query_csv(columns, chunks), content_type="text/csv"
+            )
+            response["Content-Disposition"] = "attachment; filename=custom_sql.csv"
+            return response
+        return stream_result(request, columns, chunks, sql_query)
     else:
-        return redirect("operation")
+        return redirect("sql:operation")
 
 
-def execute_form(request, type_sql, name):
+def execute(request, name):
     try:
-        if type_sql == "FUNCTION":
-            columns, rows = call_func(name, [])
-        else:
-            columns, rows = call_proc(name, [])
-        if "export_csv" in request.POST:
-            export_csv(columns, rows, name)
-        return render(
-            request,
-            "sql/result_sql.html",
-            {"column": columns, "rows": rows, "name": name, "type": True},
-        )
-    except (ValueError, TypeError, OperationalError, DatabaseError) as err:
-        request.logger.warning(
+        procedure = get_procedure(name)
+    except LookupError as err:
+        request.logger.error(
             "%s %s %s %s %s",
             request.method,
             request.path,
             request.META.get("REMOTE_ADDR"),
-            f"Error in executing {type_sql}: {str(err)}",
+            "There is no such procedure: ",
+            str(err),
         )
-        return render(request, "sql/result_sql.html", {"error_message": str(err)})
-
-
-def execute(request, type_sql, name, params):
-    if re.sub(r"IN [a-zA-Z_]+ refcursor", "", params) == "":
-        return execute_form(request, type_sql, name)
-    form = DynamicForm(param_string=params)
+        return HttpResponseBadRequest("Такой процедуры или функции не существует!")
+    # ?explain=1 - выполнить без кэша и сохранить план. Задача ставится
+    # только по POST, в том числе для процедур без параметров: GET-запрос
+    # (переход по ссылке, предзагрузка) лишь показывает форму
+    explain = "explain" in request.GET
+    form = DynamicForm(procedure)
     if request.method == "POST":
-        form = DynamicForm(param_string=params, data=request.POST)
+        form = DynamicForm(procedure, data=request.POST)
         if form.is_valid():
-            params_list = []
-            for field_name, field in form.fields.items():
-                if field.widget.is_hidden and field.widget.attrs.get("refcursor", None):
-                    continue
-                params_list.append(form.cleaned_data[field_name])
-            try:
-                if type_sql == "FUNCTION":
-                    columns, rows = call_func(name, params_list)
-                else:
-                    columns, rows = call_proc(name, params_list)
-                save_session(request, columns, rows)
-                return render(
-                    request,
-                    "sql/result_sql.html",
-                    {"column": columns, "rows": rows, "name": name, "type": True},
-                )
-            except (ValueError, TypeError, OperationalError, DatabaseError) as err:
-                request.logger.warning(
-                    "%s %s %s %s %s",
-                    request.method,
-                    request.path,
-                    request.META.get("REMOTE_ADDR"),
-                    "Error in execution sql query: ",
-                    str(err),
-                )
-                return render(
-                    request, "sql/result_sql.html", {"error_message": str(err)}
-                )
+            job = submit(
+                "call", type=procedure.type, name=name, params=form.params(), explain=explain
+            )
+            return redirect("sql:job", job_id=job.pk)
         else:
-            if "export_csv" in request.POST:
-                export_csv(
-                    request.session.get("columns"), request.session.get("rows"), name
-                )
-                return render(
-                    request,
-                    "sql/result_sql.html",
-                    {
-                        "column": request.session.get("columns"),
-                        "rows": request.session.get("rows"),
-                        "name": name,
-                        "type": True,
-                    },
-                )
             error_message = "Форма была неверной"
             request.logger.warning(
                 "%s %s %s %s %s",
@@ -204,33 +244,118 @@ def execute(request, type_sql, name, params):
     return render(
         request,
         "sql/execute.html",
-        {"form": form, "type": type_sql, "name": name, "name": name},
+        {"form": form, "type": procedure.type, "name": name},
     )
 
 
-def save_session(request, columns, rows):
-    request.session["columns"] = columns
-    new_rows = []
-    for row in rows:
-        new_row = []
-        for value in row:
-            if isinstance(value, (datetime.date, datetime.datetime)):
-                new_row.append(value.strftime("%Y-%m-%d"))
-            elif isinstance(value, Decimal):
-                new_row.append(str(value))
-            else:
-                new_row.append(value)
-        new_rows.append(tuple(new_row))
-    request.session["rows"] = new_rows
-
-
-def export_csv(columns, rows, name):
-    file = (
-        os.path.abspath(__file__).replace(os.path.basename(__file__), "../data/")
-        + name
-        + ".csv"
+# Результат процедуры или функции файлом CSV: строки читаются из курсора
+# порциями и сразу отправляются клиенту
+def download(request, name):
+    try:
+        procedure = get_procedure(name)
+    except LookupError as err:
+        request.logger.error(
+            "%s %s %s %s %s",
+            request.method,
+            request.path,
+            request.META.get("REMOTE_ADDR"),
+            "There is no such procedure: ",
+            str(err),
+        )
+        return HttpResponseBadRequest("Такой процедуры или функции не существует!")
+    params = []
+    if procedure.input_args:
+        form = DynamicForm(procedure, data=request.POST if request.method == "POST" else request.GET)
+        if not form.is_valid():
+            request.logger.warning(
+                "%s %s %s %s %s",
+                request.method,
+                request.path,
+                request.META.get("REMOTE_ADDR"),
+                "Error in executing the SQL query: incorrect form",
+                form.errors.as_text(),
+            )
+            return render(
+                request, "sql/result_sql.html", {"error_message": "Форма была неверной"}
+            )
+        params = form.params()
+    try:
+        columns, chunks = call_chunks(procedure, params)
+    except (OperationalError, DatabaseError) as err:
+        request.logger.warning(
+            "%s %s %s %s %s",
+            request.method,
+            request.path,
+            request.META.get("REMOTE_ADDR"),
+            "Error in execution procedure: ",
+            str(err),
+        )
+        return render(request, "sql/result_sql.html", {"error_message": str(err)})
+    return csv_response(request, iter_query_csv(columns, chunks), name)
+
+
+def job(request, job_id: int):
+    job = get_object_or_404(Job, pk=job_id)
+    if request.GET.get("format") == "json":
+        return JsonResponse(
+            {
+                "id": job.pk,
+                "kind": job.kind,
+                "status": job.status,
+                "processed": job.processed,
+                "progress": job.progress,
+                "elapsed": job.elapsed,
+                "eta": job.eta,
+                "error": job.error,
+                "result": reverse("sql:job_result", kwargs={"job_id": job.pk}),
+            }
+        )
+    if job.status == JobStatus.DONE:
+        return redirect("sql:job_result", job_id=job.pk)
+    return render(request, "sql/job.html", {"job": job, "title": f"Задача {job.pk}"})
+
+
+# Результат задачи после завершения не меняется. ETag выдается только для
+# завершенного вызова и слабый: сжатый и несжатый ответы совпадают по
+# содержанию, но не побайтно
+def job_etag(request, job_id: int):
+    if not Job.objects.filter(pk=job_id, status=JobStatus.DONE, kind="call").exists():
+        return None
+    return f'W/"job-{job_id}-{request.GET.urlencode()}"'
+
+
+@vary_on_headers("Accept-Encoding")
+@condition(etag_func=job_etag)
+def job_result(request, job_id: int):
+    job = get_object_or_404(Job, pk=job_id, status=JobStatus.DONE)
+    if job.kind != "call":
+        return redirect("sql:data_read", table=job.params["table"])
+    columns, name = job.result["columns"], job.params["name"]
+    # Строки лежат в хранилище результатов, в задаче - только ссылка на них
+    # (у задач, выполненных до появления хранилища, строки лежат в самой задаче)
+    if "handle" in job.result:
+        rows = StoredRows(job.result["handle"], job.result["rows"])
+    else:
+        rows = job.result["rows"]
+    # ?format=csv - скачать результат целиком, не выполняя запрос повторно
+    # Удаленный очисткой результат - 410, а не обрезанный файл или пустая страница
+    try:
+        if request.GET.get("format") == "csv":
+            chunks = iter_result(rows.handle) if isinstance(rows, StoredRows) else [rows]
+            return csv_response(request, iter_query_csv(columns, chunks), name)
+        # Большой результат показывается постранично по SQL_DISPLAY_ROWS строк
+        page = Paginator(rows, settings.SQL_DISPLAY_ROWS).get_page(request.GET.get("page"))
+    except LookupError as err:
+        return render(request, "sql/result_sql.html", {"error_message": str(err)}, status=410)
+    return render(
+        request,
+        "sql/result_sql.html",
+        {
+            "column": columns,
+            "rows": page.object_list,
+            "page_obj": page,
+            "truncated": job.result.get("truncated", False),
+            "name": name,
+            "type": True,
+        },
     )
-    with open(file, "w", newline="", encoding="utf8") as f:
-        writer = csv.writer(f)
-        writer.writerow(columns)
-        writer.writerows(rows)